@@ -1,10 +1,33 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from dateutil import tz
 import requests
-from typing import Optional, List, Dict
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Optional, List, Dict, Any, Tuple, Hashable, NamedTuple
+import asyncio
+import click
+import csv
+import heapq
+import io
+import itertools
+import json
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,6 +47,57 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 18_6_2 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148"
 }
 
+# Upstream HTTP client configuration
+UPSTREAM_POOL_SIZE = 20  # keep-alive connections kept open to the API host
+UPSTREAM_TIMEOUT = 10  # seconds
+UPSTREAM_MAX_RETRIES = 2
+UPSTREAM_RETRY_BACKOFF = 0.3  # seconds, doubled on each retry
+UPSTREAM_RETRY_STATUSES = (429, 500, 502, 503, 504)
+UPSTREAM_CONCURRENCY = 10  # upstream lookups in flight per route request
+UPSTREAM_MAX_IN_FLIGHT = 16  # upstream HTTP requests in flight across the whole process
+UPSTREAM_WORKERS = 32  # threads in the shared pool that runs blocking upstream lookups
+
+# Budget of upstream calls shared by every request, as the API key's quota is
+UPSTREAM_BUDGET_PER_MINUTE = int(os.environ.get("UPSTREAM_BUDGET_PER_MINUTE", "300"))  # per process
+UPSTREAM_PRIORITY_DEPARTURES = 0
+UPSTREAM_PRIORITY_FIRST_LEG = 1  # timetables of a route's first leg
+UPSTREAM_PRIORITY_LATER_LEGS = 2  # timetables of the following legs
+UPSTREAM_BUDGET_RESERVES = (0, 0.1, 0.3)  # share of the budget each priority must leave for higher ones
+
+# Circuit breaker and adaptive timeout per upstream endpoint
+CIRCUIT_WINDOW = 20  # recent calls the breaker judges an endpoint by
+CIRCUIT_MIN_CALLS = 10  # calls needed before the breaker may open, or the timeout adapts
+CIRCUIT_FAILURE_RATIO = 0.5  # share of failed or slow recent calls that opens the breaker
+CIRCUIT_SLOW_CALL = 5  # seconds after which even a successful call counts against the endpoint
+CIRCUIT_OPEN_INTERVAL = 15  # seconds calls are refused before a probe call is let through
+ADAPTIVE_TIMEOUT_FACTOR = 3  # timeout as a multiple of the p95 latency of recent successful calls
+ADAPTIVE_TIMEOUT_MIN = 2  # seconds; UPSTREAM_TIMEOUT is the maximum
+ADAPTIVE_LATENCY_WINDOW = 200  # successful calls the p95 latency is taken over
+DEPARTURES_BATCH_RETRY_INTERVAL = 600  # seconds of single-stop calls after a batched departures call is rejected
+
+# Route collection: after the deadline, answer as soon as this many routes are complete
+ROUTE_COLLECTION_DEADLINE = 4  # seconds
+ROUTE_COLLECTION_MIN_ROUTES = 6  # best route + 5 other options shown in the response
+TRANSFER_CONNECTIONS = 3  # connecting departures considered at each transfer
+
+# Serving the last good route set while the upstream API is degraded
+ROUTE_MAX_STALENESS = 300  # seconds; default of RouteDefinition.max_staleness
+STALE_ROUTES_GRACE = 1.0  # seconds (within budget_ms) a recomputation may take before the last good route set is served
+ROUTE_REFRESH_WORKERS = 16  # threads recomputing route sets, which keep running after a stale response
+
+# Ride durations learned from past timetable responses
+ESTIMATOR_SMOOTHING = 0.2  # weight of the newest observation in a segment's running mean and variance
+ESTIMATOR_MIN_SAMPLES = 5  # observed journeys before a segment's estimate is fully trusted
+ESTIMATOR_MAX_SPREAD = 3  # minutes of standard deviation at which confidence drops to zero
+ESTIMATOR_MIN_CONFIDENCE = 0.8  # estimates at least this confident skip the timetable lookup
+ESTIMATOR_CONFIDENCE_HALF_LIFE = 900  # seconds; confidence halves while a segment goes unobserved
+ESTIMATOR_MAX_JOURNEYS = 2048  # journeys remembered so each is learned from once
+
+# Latency budget: past it, respond with the routes computed so far (budget_ms query parameter)
+DEFAULT_BUDGET_MS = 8000
+MIN_BUDGET_MS = 500
+MAX_BUDGET_MS = 30000
+
 # Stop IDs
 STOPS = {
     "booterstown": "8250DB002069",  # Booterstown Avenue, Mount Merrion
@@ -38,52 +112,1244 @@ WALK_TIME_WESTMORELAND_TO_EDEN = 6  # minutes (to-home route)
 WALK_TIME_HAWKINS_TO_DOLIER = 5  # minutes (to-date route)
 
 
-def get_departures(stop_id: str, stop_name: str) -> List[Dict]:
-    """Get departures from a specific stop"""
+@dataclass(frozen=True)
+class Leg:
+    """One bus ride of a route"""
+    key: str  # key of the leg in route responses, e.g. "e_bus"
+    services: Tuple[str, ...]  # service numbers that may be taken
+    description: str  # how messages refer to the leg's buses, e.g. "E1/E2 buses"
+    service_prefix: str  # put before the service number in summaries, e.g. "bus " -> "Take bus 15"
+    direction: str  # timetable direction, INBOUND or OUTBOUND
+    origin_stop: str  # key into STOPS
+    origin_stop_name: str  # stop name sent to the departures API
+    departure_stop: str  # display name of the boarding stop
+    arrival_stop: str  # display name of the alighting stop
+    arrival_keyword: str  # matched against stop names in the leg's estimated timetable
+    default_duration: float  # minutes assumed for the last leg when neither its timetable nor a learned estimate is available
+    arrival_stop_ref: Optional[str] = None  # alighting stop reference; preferred over the keyword when set
+
+
+@dataclass(frozen=True)
+class Transfer:
+    """Walk between two consecutive legs"""
+    walk_minutes: int
+    arrival_key: str  # response key of the arrival at the previous leg's stop
+    walk_arrival_key: str  # response key of the arrival at the next leg's stop
+    walk_key: str = "walk"
+
+
+@dataclass(frozen=True)
+class RouteDefinition:
+    """A commute served at /best-route/<path>: its legs and the walks between them"""
+    name: str
+    path: str
+    response_name: str  # "route" field of responses
+    description: str
+    legs: Tuple[Leg, ...]
+    transfers: Tuple[Transfer, ...]  # one fewer than legs
+    option_service_format: str  # names the services of "other_routes", formatted with each leg's service by key
+    max_staleness: float = ROUTE_MAX_STALENESS  # seconds the last good route set may be served while upstream is degraded
+
+
+ROUTES = [
+    RouteDefinition(
+        name="to_home",
+        path="to-home",
+        response_name="to_home",
+        description="Get best route from Booterstown to home",
+        legs=(
+            Leg(
+                key="e_bus",
+                services=("E1", "E2"),
+                description="E1/E2 buses",
+                service_prefix="",
+                direction="INBOUND",
+                origin_stop="booterstown",
+                origin_stop_name="Booterstown Avenue, Mount Merrion",
+                departure_stop="Booterstown Avenue",
+                arrival_stop="Westmoreland Street",
+                arrival_keyword="Westmoreland",
+                default_duration=15
+            ),
+            Leg(
+                key="bus_15",
+                services=("15",),
+                description="bus 15",
+                service_prefix="bus ",
+                direction="INBOUND",
+                origin_stop="eden_quay",
+                origin_stop_name="Eden Quay, Dublin",
+                departure_stop="Eden Quay",
+                arrival_stop="Temple Vw Ave, Belmayne",
+                arrival_keyword="Belmayne",
+                default_duration=25
+            )
+        ),
+        transfers=(
+            Transfer(
+                walk_minutes=WALK_TIME_WESTMORELAND_TO_EDEN,
+                arrival_key="westmoreland_arrival",
+                walk_arrival_key="eden_quay_arrival"
+            ),
+        ),
+        option_service_format="{e_bus}"
+    ),
+    RouteDefinition(
+        name="to_date",
+        path="to-date",
+        response_name="to_work",
+        description="Get best route from home to Booterstown",
+        legs=(
+            Leg(
+                key="bus_15",
+                services=("15",),
+                description="bus 15",
+                service_prefix="bus ",
+                direction="OUTBOUND",
+                origin_stop="temple_view",
+                origin_stop_name="Temple Vw Ave, Clare Hall",
+                departure_stop="Temple Vw Ave, Clare Hall",
+                arrival_stop="Hawkins Street",
+                arrival_keyword="Hawkins",
+                default_duration=25
+            ),
+            Leg(
+                key="e_bus",
+                services=("E1", "E2"),
+                description="E1/E2 buses",
+                service_prefix="",
+                direction="OUTBOUND",
+                origin_stop="dolier_street",
+                origin_stop_name="D'Olier Street, Dublin City South",
+                departure_stop="D'Olier Street",
+                arrival_stop="Booterstown Avenue",
+                arrival_keyword="Booterstown",
+                default_duration=15
+            )
+        ),
+        transfers=(
+            Transfer(
+                walk_minutes=WALK_TIME_HAWKINS_TO_DOLIER,
+                arrival_key="hawkins_arrival",
+                walk_arrival_key="dolier_arrival"
+            ),
+        ),
+        option_service_format="{bus_15}→{e_bus}"
+    )
+]
+ROUTES_BY_PATH = {route.path: route for route in ROUTES}
+
+
+@dataclass(frozen=True)
+class PlanStop:
+    """A stop the /plan journey planner routes between"""
+    name: str  # display name
+    keywords: Tuple[str, ...]  # matched against stop names in estimated timetables
+    stop: Optional[str] = None  # key into STOPS, for stops whose departure boards are fetched
+
+
+# Stops of the /plan network and the walks between them (both ways)
+PLAN_STOPS = {
+    "booterstown": PlanStop("Booterstown Avenue", ("Booterstown",), stop="booterstown"),
+    "westmoreland": PlanStop("Westmoreland Street", ("Westmoreland",)),
+    "eden_quay": PlanStop("Eden Quay", ("Eden Quay",), stop="eden_quay"),
+    "temple_view": PlanStop("Temple Vw Ave", ("Belmayne", "Temple Vw"), stop="temple_view"),
+    "hawkins": PlanStop("Hawkins Street", ("Hawkins",)),
+    "dolier_street": PlanStop("D'Olier Street", ("D'Olier", "Dolier"), stop="dolier_street")
+}
+PLAN_STOP_ALIASES = {"belmayne": "temple_view", "home": "temple_view"}
+PLAN_WALKS = [
+    ("westmoreland", "eden_quay", WALK_TIME_WESTMORELAND_TO_EDEN),
+    ("hawkins", "dolier_street", WALK_TIME_HAWKINS_TO_DOLIER)
+]
+PLAN_DEFAULT_MAX_TRANSFERS = 2
+PLAN_MAX_TRANSFERS = 4
+
+# Cache configuration
+DEPARTURES_CACHE_TTL = 20  # seconds a departure board is served without refetching
+DEPARTURES_CACHE_STALE_TTL = 60  # extra seconds a stale board may be served while it refreshes
+DEPARTURES_CACHE_MAX_ENTRIES = 32
+TIMETABLE_CACHE_TTL = 30  # seconds; realtime arrival estimates drift quickly
+TIMETABLE_CACHE_MAX_ENTRIES = 512
+ROUTE_TABLE_MAX_AGE = 30  # seconds a materialized route table is reused while its boards are unchanged
+
+# Upstream responses persisted on disk, so restarted workers start warm
+DISK_CACHE_ENABLED = os.environ.get("DISK_CACHE_ENABLED", "0") == "1"
+DISK_CACHE_PATH = os.environ.get("DISK_CACHE_PATH", os.path.join(tempfile.gettempdir(), "dublin-bus-cache.sqlite3"))
+DISK_CACHE_PURGE_INTERVAL = 100  # writes between deletions of expired entries
+
+# Latency histogram buckets of /metrics, in seconds
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Background prefetching of the commute stops' departure boards
+# Disabled on Vercel, where functions are frozen between requests
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "1") == "1" and not os.environ.get("VERCEL")
+PREFETCH_STOPS = list(dict.fromkeys(
+    (STOPS[leg.origin_stop], leg.origin_stop_name) for route in ROUTES for leg in route.legs
+))
+PREFETCH_PEAK_INTERVAL = 15  # seconds between polls during commute peaks
+PREFETCH_OFFPEAK_INTERVAL = 60  # seconds between polls during the rest of the day
+PREFETCH_IDLE_CHECK_INTERVAL = 300  # seconds between wake-ups overnight, when nothing is polled
+PREFETCH_PEAK_HOURS = [(7, 10), (16, 19)]  # local [start, end) hours
+PREFETCH_IDLE_HOURS = (1, 5)  # local [start, end) hours with no service worth polling
+PREFETCH_LOCK_PATH = os.path.join(tempfile.gettempdir(), "dublin-bus-prefetch.lock")
+PREFETCH_SPOOL_PATH = os.path.join(tempfile.gettempdir(), "dublin-bus-prefetch.json")
+DUBLIN_TZ = tz.gettz("Europe/Dublin")
+
+# Scheduled stop times imported from a GTFS static feed with `flask --app app build-gtfs <feed.zip>`
+GTFS_STORE_DIR = os.environ.get("GTFS_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gtfs"))
+GTFS_SERVICES = sorted({service for route in ROUTES for leg in route.legs for service in leg.services})
+GTFS_MATCH_TOLERANCE = 90  # seconds between a live scheduled departure and the matching GTFS departure
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; every process then polls for itself
+    fcntl = None
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after a TTL
+
+    Entries older than `ttl` are still returned (flagged as stale) until they are
+    `ttl + stale_ttl` old, so callers can serve them while a refresh runs.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, stale_ttl: float = 0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """Return (value, is_fresh); value is None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age > self.ttl + self.stale_ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, age <= self.ttl
+
+    def set(self, key: Hashable, value: Any, age: float = 0):
+        """Store a value; age backdates entries that were fetched elsewhere"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() - age)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def peek(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """Like get(), without touching LRU order or hit/miss counters"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            value, stored_at = entry
+            age = time.monotonic() - stored_at
+            if age > self.ttl + self.stale_ttl:
+                return None, False
+            return value, age <= self.ttl
+
+    def begin_refresh(self, key: Hashable) -> bool:
+        """Claim the refresh of a key; False if another caller is already refreshing it"""
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: Hashable):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+DEPARTURES_CACHE = TTLCache(
+    ttl=DEPARTURES_CACHE_TTL,
+    max_entries=DEPARTURES_CACHE_MAX_ENTRIES,
+    stale_ttl=DEPARTURES_CACHE_STALE_TTL
+)
+
+# ParsedTimetables keyed by (dataFrameRef, datedVehicleJourneyRef, originStopReference)
+TIMETABLE_CACHE = TTLCache(
+    ttl=TIMETABLE_CACHE_TTL,
+    max_entries=TIMETABLE_CACHE_MAX_ENTRIES
+)
+
+
+class DiskCache:
+    """
+    SQLite store of raw upstream responses that outlives the process
+    Responses are written through after each upstream call, with their expiry,
+    and read back on an in-memory cache miss, so a fresh worker answers from
+    recent data. The database is opened on first use; after an SQLite error
+    the disk cache is disabled for the rest of the process.
+    """
+
+    def __init__(self, path: str, purge_interval: int):
+        self.path = path
+        self.purge_interval = purge_interval
+        self._db: Optional[sqlite3.Connection] = None
+        self._disabled = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=1, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "kind TEXT, key TEXT, stored_at REAL, expires_at REAL, payload TEXT, "
+                "PRIMARY KEY (kind, key))"
+            )
+            self._db = db
+        return self._db
+
+    def _disable(self, e: Exception):
+        logger.warning(f"Disabling disk cache at {self.path}: {e}")
+        self._disabled = True
+
+    def get(self, kind: str, key: str) -> Tuple[Optional[Any], float]:
+        """Return (value, age in seconds) of an unexpired entry; value is None on a miss"""
+        if self._disabled:
+            return None, 0
+        now = time.time()
+        with self._lock:
+            try:
+                row = self._connect().execute(
+                    "SELECT stored_at, payload FROM responses WHERE kind = ? AND key = ? AND expires_at > ?",
+                    (kind, key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._disable(e)
+                return None, 0
+            if row is None:
+                self.misses += 1
+                return None, 0
+            self.hits += 1
+        stored_at, payload = row
+        return json.loads(payload), max(now - stored_at, 0)
+
+    def set(self, kind: str, key: str, value: Any, ttl: float):
+        """Store a JSON-serializable value that expires after ttl seconds"""
+        if self._disabled:
+            return
+        now = time.time()
+        payload = json.dumps(value)
+        with self._lock:
+            try:
+                db = self._connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (kind, key, now, now + ttl, payload)
+                )
+                self.writes += 1
+                if self.writes % self.purge_interval == 0:
+                    db.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+            except sqlite3.Error as e:
+                self._disable(e)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": not self._disabled,
+                "path": self.path,
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+DISK_CACHE = DiskCache(DISK_CACHE_PATH, DISK_CACHE_PURGE_INTERVAL) if DISK_CACHE_ENABLED else None
+
+
+def _metric_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _metric_lines(name: str, metric_type: str, help_text: str, samples: List[Tuple[str, Dict, float]]) -> List[str]:
+    """Prometheus text exposition of one metric from (suffix, labels, value) samples"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for suffix, labels, value in samples:
+        lines.append(f"{name}{suffix}{_metric_labels(labels)} {value}")
+    return lines
+
+
+class Counter:
+    """Monotonic counter per label set, rendered for /metrics"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            samples = [("", dict(key), value) for key, value in sorted(self._values.items())]
+        return _metric_lines(self.name, "counter", self.help_text, samples)
+
+
+class Histogram:
+    """Latency histogram per label set with fixed buckets, rendered for /metrics"""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[Tuple, List] = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        samples = []
+        with self._lock:
+            series = sorted((key, [list(counts), total, count]) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", {**labels, "le": bound}, cumulative))
+            samples.append(("_sum", labels, round(total, 6)))
+            samples.append(("_count", labels, count))
+        return _metric_lines(self.name, "histogram", self.help_text, samples)
+
+
+STAGE_SECONDS = Histogram(
+    "dublin_bus_stage_seconds",
+    "Duration of each stage of a route request: departures, leg_N_timetable lookups, route_assembly, rendering"
+)
+UPSTREAM_SECONDS = Histogram("dublin_bus_upstream_seconds", "Duration of upstream API calls by endpoint")
+UPSTREAM_CALLS_TOTAL = Counter(
+    "dublin_bus_upstream_calls_total",
+    "Upstream API calls by endpoint and HTTP status, or why no response was received"
+)
+
+
+class DeadlineExceeded(Exception):
+    """The request's latency budget ran out before an upstream call could complete"""
+
+
+def time_left(deadline: Optional[float]) -> Optional[float]:
+    """Seconds until a time.monotonic() deadline; None when there is no deadline"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class _InFlightCall:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into a single execution
+
+    The first caller runs the function; callers arriving while it is in flight
+    wait for it (up to their own timeout) and receive the same result or exception.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _InFlightCall] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn, timeout: Optional[float] = None):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self._calls[key] = call
+            else:
+                self.coalesced += 1
+        
+        if not is_leader:
+            if not call.done.wait(timeout):
+                raise DeadlineExceeded(f"Timed out waiting on in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "coalesced": self.coalesced
+            }
+
+
+UPSTREAM_CALLS = SingleFlight()
+
+
+class WorkerPool:
+    """Long-lived thread pool shared by all requests, tracking queue depth and utilization"""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self.completed = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            self._queued += 1
+        future = self._executor.submit(self._run, fn, args, kwargs)
+        future.add_done_callback(self._on_done)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the pool from a coroutine"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _run(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self.completed += 1
+
+    def _on_done(self, future: Future):
+        # A task cancelled while still queued never reaches _run
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self._active,
+                "queue_depth": self._queued,
+                "utilization": round(self._active / self.max_workers, 3),
+                "completed": self.completed
+            }
+
+
+class ConcurrencyLimit:
+    """Process-wide cap on concurrent upstream calls"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None):
+        """Hold one slot for the duration of the block, waiting at most timeout seconds for it"""
+        with self._lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=max(timeout, 0) if timeout is not None else None)
+        with self._lock:
+            self._waiting -= 1
+            if acquired:
+                self._in_flight += 1
+        if not acquired:
+            raise DeadlineExceeded("No upstream slot freed up before the deadline")
+        
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting
+            }
+
+
+class RateLimited(Exception):
+    """The upstream call budget has no tokens left for a call of this priority"""
+
+
+class TokenBucket:
+    """
+    Process-wide budget of upstream calls, refilled continuously at `per_minute`
+    Each priority may only spend tokens above its reserve, so as the budget runs
+    low the remaining calls go to departures first, then first-leg timetables.
+    """
+
+    def __init__(self, per_minute: int, reserves: Tuple[float, ...]):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self.reserves = reserves
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.spent = [0] * len(reserves)
+        self.rejected = [0] * len(reserves)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def available(self, priority: int) -> bool:
+        """Whether a call of this priority would currently be allowed"""
+        with self._lock:
+            self._refill()
+            return self._tokens - 1 >= self.reserves[priority] * self.capacity
+
+    def take(self, priority: int):
+        """Spend a token on a call of this priority, or raise RateLimited"""
+        with self._lock:
+            self._refill()
+            if self._tokens - 1 < self.reserves[priority] * self.capacity:
+                self.rejected[priority] += 1
+                raise RateLimited(f"Upstream call budget exhausted for priority {priority} calls")
+            self._tokens -= 1
+            self.spent[priority] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._refill()
+            return {
+                "per_minute": self.per_minute,
+                "remaining": int(self._tokens),
+                "spent": list(self.spent),
+                "rejected": list(self.rejected)
+            }
+
+
+UPSTREAM_BUDGET = TokenBucket(UPSTREAM_BUDGET_PER_MINUTE, UPSTREAM_BUDGET_RESERVES)
+
+
+class CircuitOpen(Exception):
+    """An upstream endpoint is failing; calls are refused until the breaker's next probe"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream endpoint, with a latency-adaptive timeout
+    Opens once enough recent calls failed or were slow, then refuses calls for
+    `open_interval` seconds. After that a single probe call is let through: its
+    success closes the breaker, its failure opens it again. Calls that started
+    before the breaker opened do not count as the probe. The timeout follows
+    the p95 latency of recent successful calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: int,
+        min_calls: int,
+        failure_ratio: float,
+        slow_call: float,
+        open_interval: float,
+        timeout_factor: float,
+        min_timeout: float,
+        max_timeout: float,
+        latency_window: int
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call = slow_call
+        self.open_interval = open_interval
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._outcomes: deque = deque(maxlen=window)  # True for failed or slow calls
+        self._latencies: deque = deque(maxlen=latency_window)
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probe_at: Optional[float] = None
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> Optional[float]:
+        """Raise CircuitOpen unless a call may go through now; returns a probe token when the call is the probe"""
+        with self._lock:
+            if self.state == "closed":
+                return None
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.open_interval:
+                self.state = "half_open"
+                self._probe_at = None
+            # One probe at a time; a probe that never reported back is replaced after a full timeout
+            if self.state == "half_open" and (self._probe_at is None or now - self._probe_at > self.max_timeout):
+                self._probe_at = now
+                return now
+            self.rejected += 1
+        raise CircuitOpen(f"{self.name} circuit breaker is open")
+
+    def is_open(self) -> bool:
+        """Whether calls are currently refused, short of the next probe"""
+        with self._lock:
+            return self.state == "open" and time.monotonic() - self._opened_at < self.open_interval
+
+    def release(self, probe: Optional[float]):
+        """Give back the probe claim of a call that was never made, so the next call can probe"""
+        with self._lock:
+            if probe is not None and probe == self._probe_at:
+                self._probe_at = None
+
+    def record(self, ok: bool, elapsed: float, probe: Optional[float] = None):
+        """Report the outcome of a call that went through, with its probe token if allow() gave one"""
+        bad = not ok or elapsed > self.slow_call
+        with self._lock:
+            if ok:
+                self._latencies.append(elapsed)
+            if self.state == "half_open":
+                if probe is None or probe != self._probe_at:
+                    return
+                if bad:
+                    self._open()
+                else:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                    logger.info(f"{self.name} circuit breaker closed")
+                return
+            
+            self._outcomes.append(bad)
+            if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                    and sum(self._outcomes) / len(self._outcomes) >= self.failure_ratio):
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+        logger.warning(f"{self.name} circuit breaker opened for {self.open_interval}s")
+
+    def timeout(self) -> float:
+        """Request timeout in seconds: a multiple of the recent p95 latency, within bounds"""
+        with self._lock:
+            if len(self._latencies) < self.min_calls:
+                return self.max_timeout
+            ordered = sorted(self._latencies)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_factor))
+
+    def stats(self) -> Dict:
+        timeout = self.timeout()
+        with self._lock:
+            return {
+                "state": self.state,
+                "recent_failures": sum(self._outcomes),
+                "recent_calls": len(self._outcomes),
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "timeout_seconds": round(timeout, 2)
+            }
+
+
+UPSTREAM_BREAKERS = {
+    endpoint: CircuitBreaker(
+        name=endpoint,
+        window=CIRCUIT_WINDOW,
+        min_calls=CIRCUIT_MIN_CALLS,
+        failure_ratio=CIRCUIT_FAILURE_RATIO,
+        slow_call=CIRCUIT_SLOW_CALL,
+        open_interval=CIRCUIT_OPEN_INTERVAL,
+        timeout_factor=ADAPTIVE_TIMEOUT_FACTOR,
+        min_timeout=ADAPTIVE_TIMEOUT_MIN,
+        max_timeout=UPSTREAM_TIMEOUT,
+        latency_window=ADAPTIVE_LATENCY_WINDOW
+    )
+    for endpoint in ("departures", "estimatedTimetable")
+}
+
+UPSTREAM_POOL = WorkerPool(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+UPSTREAM_LIMIT = ConcurrencyLimit(UPSTREAM_MAX_IN_FLIGHT)
+
+
+def _create_upstream_session() -> Tuple[requests.Session, HTTPAdapter]:
+    """Create the pooled keep-alive session shared by all upstream calls"""
+    # Retries are made by post_upstream, which knows the caller's deadline
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=UPSTREAM_POOL_SIZE,
+        max_retries=Retry(total=0, read=False, raise_on_status=False)
+    )
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+UPSTREAM_SESSION, UPSTREAM_ADAPTER = _create_upstream_session()
+
+
+def _retry_delay(
+    attempt: int,
+    response: Optional[requests.Response],
+    deadline: Optional[float],
+    priority: int
+) -> Optional[float]:
+    """
+    Seconds to wait before retrying a failed attempt, or None when no retry is
+    left, fits the deadline or fits the call budget
+    """
+    if attempt >= UPSTREAM_MAX_RETRIES:
+        return None
+    delay = UPSTREAM_RETRY_BACKOFF * 2 ** attempt
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass  # HTTP-date form; the backoff is used instead
+    remaining = time_left(deadline)
+    if delay > UPSTREAM_TIMEOUT or (remaining is not None and remaining <= delay):
+        return None
+    # Every attempt counts against the API key's quota, which 429s say is running out
+    try:
+        UPSTREAM_BUDGET.take(priority)
+    except RateLimited:
+        return None
+    return delay
+
+
+def post_upstream(
+    endpoint: str,
+    payload: Dict,
+    deadline: Optional[float] = None,
+    priority: int = UPSTREAM_PRIORITY_DEPARTURES
+) -> Dict:
+    """POST a payload to an LTS API endpoint over the pooled session and decode the JSON reply
+
+    The endpoint's circuit breaker sets the timeout from recent latencies and
+    raises CircuitOpen while the endpoint is failing; RateLimited is raised when
+    the call budget has nothing left for the priority. Transport errors and
+    429/5xx responses are retried with backoff. With a deadline, each attempt's
+    timeout shrinks to the time left, retries are only made while they fit, and
+    DeadlineExceeded is raised once no time is left.
+    """
+    breaker = UPSTREAM_BREAKERS[endpoint]
+    probe = None
+    try:
+        probe = breaker.allow()
+        UPSTREAM_BUDGET.take(priority)
+        with UPSTREAM_LIMIT.slot(timeout=time_left(deadline)):
+            attempt = 0
+            while True:
+                timeout = breaker.timeout()
+                remaining = time_left(deadline)
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise DeadlineExceeded(f"No time left to call {endpoint}")
+                    timeout = min(timeout, remaining)
+                
+                started = time.monotonic()
+                try:
+                    response = UPSTREAM_SESSION.post(
+                        f"{API_BASE_URL}/{endpoint}",
+                        json=payload,
+                        timeout=timeout
+                    )
+                except requests.RequestException:
+                    elapsed = time.monotonic() - started
+                    UPSTREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+                    UPSTREAM_CALLS_TOTAL.inc(endpoint=endpoint, status="error")
+                    delay = _retry_delay(attempt, None, deadline, priority)
+                    if delay is None:
+                        breaker.record(False, elapsed, probe)
+                        raise
+                else:
+                    elapsed = time.monotonic() - started
+                    UPSTREAM_SECONDS.observe(elapsed, endpoint=endpoint)
+                    UPSTREAM_CALLS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+                    if response.status_code not in UPSTREAM_RETRY_STATUSES:
+                        break
+                    delay = _retry_delay(attempt, response, deadline, priority)
+                    if delay is None:
+                        break
+                attempt += 1
+                time.sleep(delay)
+    except CircuitOpen:
+        UPSTREAM_CALLS_TOTAL.inc(endpoint=endpoint, status="circuit_open")
+        raise
+    except RateLimited:
+        breaker.release(probe)
+        UPSTREAM_CALLS_TOTAL.inc(endpoint=endpoint, status="rate_limited")
+        raise
+    except DeadlineExceeded:
+        breaker.release(probe)
+        UPSTREAM_CALLS_TOTAL.inc(endpoint=endpoint, status="deadline")
+        raise
+    # Other client errors are the request's fault, not the endpoint's
+    breaker.record(response.status_code < 500 and response.status_code != 429, elapsed, probe)
+    response.raise_for_status()
+    return response.json()
+
+
+def upstream_connection_stats() -> Dict:
+    """Connection reuse of the pooled session: every request beyond the first on a connection skips a handshake"""
+    pools = UPSTREAM_ADAPTER.poolmanager.pools
+    connections_opened = 0
+    requests_sent = 0
+    for key in list(pools.keys()):
+        pool = pools.get(key)
+        if pool is None:
+            continue
+        connections_opened += pool.num_connections
+        requests_sent += pool.num_requests
+    return {
+        "pool_size": UPSTREAM_POOL_SIZE,
+        "connections_opened": connections_opened,
+        "requests_sent": requests_sent,
+        "reuse_ratio": round(1 - connections_opened / requests_sent, 3) if requests_sent else None
+    }
+
+
+@dataclass(frozen=True, slots=True)
+class Departure:
+    """
+    Departure board entry, holding only the fields the route engine uses
+    Built once per upstream response; instances are immutable, so cached boards
+    are shared safely between threads.
+    """
+    service_number: Optional[str]
+    service_id: Optional[str]
+    destination: Optional[str]
+    scheduled_departure: Optional[str]  # raw API timestamps, sent back to /estimatedTimetable
+    realtime_departure: Optional[str]
+    departure_time: Optional[datetime]  # realtime, falling back to scheduled
+    cancelled: bool
+    data_frame_ref: Optional[str]
+    dated_vehicle_journey_ref: Optional[str]
+
+    @classmethod
+    def from_api(cls, entry: Dict) -> "Departure":
+        vehicle = entry.get("vehicle") or {}
+        realtime = entry.get("realTimeDeparture")
+        scheduled = entry.get("scheduledDeparture")
+        time_str = realtime or scheduled
+        return cls(
+            service_number=entry.get("serviceNumber"),
+            service_id=entry.get("serviceID"),
+            destination=entry.get("destination"),
+            scheduled_departure=scheduled,
+            realtime_departure=realtime,
+            departure_time=parse_datetime(time_str) if time_str else None,
+            cancelled=entry.get("cancelled", False),
+            data_frame_ref=vehicle.get("dataFrameRef"),
+            dated_vehicle_journey_ref=vehicle.get("datedVehicleJourneyRef")
+        )
+
+    def to_api(self) -> Dict:
+        """The API fields this departure was built from, e.g. for JSON serialization"""
+        return {
+            "serviceNumber": self.service_number,
+            "serviceID": self.service_id,
+            "destination": self.destination,
+            "scheduledDeparture": self.scheduled_departure,
+            "realTimeDeparture": self.realtime_departure,
+            "cancelled": self.cancelled,
+            "vehicle": {
+                "dataFrameRef": self.data_frame_ref,
+                "datedVehicleJourneyRef": self.dated_vehicle_journey_ref
+            }
+        }
+
+    @property
+    def is_realtime(self) -> bool:
+        return self.realtime_departure is not None
+
+    @property
+    def has_journey_refs(self) -> bool:
+        return bool(self.data_frame_ref and self.dated_vehicle_journey_ref)
+
+
+def _departures_payload(stop_ids: List[str], stop_name: str) -> Dict:
     now = datetime.utcnow()
-    
-    payload = {
+    return {
         "clientTimeZoneOffsetInMS": 0,
         "departureDate": now.isoformat() + "Z",
         "departureTime": now.isoformat() + "Z",
-        "stopIds": [stop_id],
+        "stopIds": stop_ids,
         "stopType": "BUS_STOP",
         "stopName": stop_name,
         "requestTime": now.isoformat() + "Z",
         "departureOrArrival": "DEPARTURE",
         "refresh": True
     }
+
+
+def _fetch_departures(stop_id: str, stop_name: str, deadline: Optional[float] = None) -> Optional[List[Departure]]:
+    """Fetch departures for a stop from the API; None if the call failed"""
+    payload = _departures_payload([stop_id], stop_name)
     
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/departures",
-            json=payload,
-            headers=HEADERS,
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = post_upstream("departures", payload, deadline=deadline)
         
         if data.get("status", {}).get("success"):
-            return data.get("stopDepartures", [])
+            return [Departure.from_api(d) for d in data.get("stopDepartures", [])]
         else:
             logger.error(f"API returned unsuccessful status: {data}")
-            return []
+            return None
+    except DeadlineExceeded:
+        logger.info(f"Skipped departures for {stop_id}: latency budget exhausted")
+        return None
+    except (CircuitOpen, RateLimited) as e:
+        logger.info(f"Skipped departures for {stop_id}: {e}")
+        return None
     except Exception as e:
         logger.error(f"Error getting departures: {e}")
+        return None
+
+
+# time.monotonic() until which departures are fetched one stop at a time
+DEPARTURES_BATCH_STATE = {"disabled_until": 0.0}
+
+
+def _fetch_departures_batch(
+    stops: List[Tuple[str, str]],
+    deadline: Optional[float] = None
+) -> Optional[Dict[str, List[Departure]]]:
+    """
+    Fetch departures for several stops in one API call, split by stop
+    None if the call failed, any departure does not say which stop it is for
+    or any stop got no departures (the API may have answered for one stop
+    only), in which case the stops should be fetched one by one.
+    """
+    stop_ids = [stop_id for stop_id, _ in stops]
+    # The API takes a single stop name, which only labels the request
+    payload = _departures_payload(stop_ids, stops[0][1])
+    
+    try:
+        data = post_upstream("departures", payload, deadline=deadline)
+    except DeadlineExceeded:
+        logger.info(f"Skipped departures for {', '.join(stop_ids)}: latency budget exhausted")
+        return None
+    except (CircuitOpen, RateLimited) as e:
+        logger.info(f"Skipped departures for {', '.join(stop_ids)}: {e}")
+        return None
+    except Exception as e:
+        logger.warning(f"Batched departures call for {', '.join(stop_ids)} failed: {e}")
+        return None
+    if not data.get("status", {}).get("success"):
+        logger.warning(f"Batched departures call for {', '.join(stop_ids)} was rejected: {data.get('status')}")
+        DEPARTURES_BATCH_STATE["disabled_until"] = time.monotonic() + DEPARTURES_BATCH_RETRY_INTERVAL
+        return None
+    
+    boards = {stop_id: [] for stop_id in stop_ids}
+    for entry in data.get("stopDepartures", []):
+        stop_id = entry.get("stopRef") or entry.get("stopReference")
+        if stop_id not in boards:
+            logger.warning("Batched departures response cannot be split by stop")
+            DEPARTURES_BATCH_STATE["disabled_until"] = time.monotonic() + DEPARTURES_BATCH_RETRY_INTERVAL
+            return None
+        boards[stop_id].append(Departure.from_api(entry))
+    missing = [stop_id for stop_id, departures in boards.items() if not departures]
+    if missing:
+        logger.warning(f"Batched departures response has nothing for {', '.join(missing)}")
+        DEPARTURES_BATCH_STATE["disabled_until"] = time.monotonic() + DEPARTURES_BATCH_RETRY_INTERVAL
+        return None
+    return boards
+
+
+def _store_departures(stop_id: str, departures: List[Departure]):
+    DEPARTURES_CACHE.set(stop_id, departures)
+    if DISK_CACHE is not None:
+        DISK_CACHE.set("departures", stop_id, [d.to_api() for d in departures],
+                       ttl=DEPARTURES_CACHE_TTL + DEPARTURES_CACHE_STALE_TTL)
+
+
+def _load_departures(stop_id: str, stop_name: str, deadline: Optional[float] = None) -> Optional[List[Departure]]:
+    """Fetch a stop's departures once for all concurrent callers and cache them"""
+    def fetch():
+        departures = _fetch_departures(stop_id, stop_name, deadline=deadline)
+        if departures is not None:
+            _store_departures(stop_id, departures)
+        return departures
+    
+    try:
+        return UPSTREAM_CALLS.do(("departures", stop_id), fetch, timeout=time_left(deadline))
+    except DeadlineExceeded:
+        return None
+
+
+def _load_departures_batch(
+    stops: List[Tuple[str, str]],
+    deadline: Optional[float] = None
+) -> Optional[Dict[str, List[Departure]]]:
+    """Fetch several stops' departures in one call, once for all concurrent callers, and cache them"""
+    if time.monotonic() < DEPARTURES_BATCH_STATE["disabled_until"]:
+        return None
+    
+    def fetch():
+        boards = _fetch_departures_batch(stops, deadline=deadline)
+        for stop_id, departures in (boards or {}).items():
+            _store_departures(stop_id, departures)
+        return boards
+    
+    try:
+        return UPSTREAM_CALLS.do(("departures",) + tuple(stop_id for stop_id, _ in stops), fetch,
+                                 timeout=time_left(deadline))
+    except DeadlineExceeded:
+        return None
+
+
+def _restore_departures(stop_id: str) -> Tuple[Optional[List[Departure]], bool]:
+    """Load a stop's departures from the disk cache into the memory cache; returns (departures, is_fresh)"""
+    if DISK_CACHE is None:
+        return None, False
+    entries, age = DISK_CACHE.get("departures", stop_id)
+    if entries is None:
+        return None, False
+    departures = [Departure.from_api(d) for d in entries]
+    DEPARTURES_CACHE.set(stop_id, departures, age=age)
+    return departures, age <= DEPARTURES_CACHE_TTL
+
+
+def _refresh_departures(stop_id: str, stop_name: str):
+    """Refetch a stop's departures into the cache, releasing the refresh claim when done"""
+    try:
+        _load_departures(stop_id, stop_name)
+    finally:
+        DEPARTURES_CACHE.end_refresh(stop_id)
+
+
+def get_departures(stop_id: str, stop_name: str, deadline: Optional[float] = None) -> List[Departure]:
+    """Get departures from a specific stop
+
+    Served from the shared cache when possible. A stale entry is returned right
+    away while the shared worker pool refreshes it. Gives up (returning an empty
+    list) once the time.monotonic() deadline passes.
+    """
+    cached = _cached_departures(stop_id, stop_name)
+    if cached is not None:
+        return cached
+    
+    departures = _load_departures(stop_id, stop_name, deadline=deadline)
+    if departures is None:
         return []
+    return departures
 
 
-def get_estimated_timetable(
+def _cached_departures(stop_id: str, stop_name: str) -> Optional[List[Departure]]:
+    """A stop's cached departures, refreshing them in the background when stale; None on a miss"""
+    cached, is_fresh = DEPARTURES_CACHE.get(stop_id)
+    if cached is None:
+        cached, is_fresh = _restore_departures(stop_id)
+    if cached is not None and not is_fresh and DEPARTURES_CACHE.begin_refresh(stop_id):
+        UPSTREAM_POOL.submit(_refresh_departures, stop_id, stop_name)
+    return cached
+
+
+def get_departures_batch(stops: List[Tuple[str, str]], deadline: Optional[float] = None) -> Dict[str, List[Departure]]:
+    """Get departures from several (stop_id, stop_name) stops
+
+    Cached boards are served as in get_departures; the others are fetched in a
+    single upstream call. Stops that call could not be fetched for are left out,
+    for the caller to fetch one by one.
+    """
+    boards = {}
+    missing = []
+    for stop_id, stop_name in stops:
+        cached = _cached_departures(stop_id, stop_name)
+        if cached is not None:
+            boards[stop_id] = cached
+        else:
+            missing.append((stop_id, stop_name))
+    
+    # A single missing stop is left to the caller's single-stop call
+    if len(missing) > 1:
+        boards.update(_load_departures_batch(missing, deadline=deadline) or {})
+    return boards
+
+
+def _fetch_estimated_timetable(
     timetable_id: str,
     direction: str,
     origin_stop_ref: str,
     origin_departure_time: str,
     origin_departure_realtime: str,
     data_frame_ref: str,
-    dated_vehicle_journey_ref: str
+    dated_vehicle_journey_ref: str,
+    deadline: Optional[float] = None,
+    priority: int = UPSTREAM_PRIORITY_FIRST_LEG
 ) -> Optional[Dict]:
-    """Get estimated timetable for a specific journey"""
+    """Fetch the estimated timetable for a journey from the API; None if the call failed"""
     now = datetime.utcnow()
     
     payload = {
@@ -101,370 +1367,1426 @@ def get_estimated_timetable(
     }
     
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/estimatedTimetable",
-            json=payload,
-            headers=HEADERS,
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
+        data = post_upstream("estimatedTimetable", payload, deadline=deadline, priority=priority)
         
         if data.get("status", {}).get("success"):
             return data
         else:
             logger.error(f"API returned unsuccessful status: {data}")
             return None
+    except DeadlineExceeded:
+        logger.info(f"Skipped timetable for {dated_vehicle_journey_ref}: latency budget exhausted")
+        return None
+    except (CircuitOpen, RateLimited) as e:
+        logger.info(f"Skipped timetable for {dated_vehicle_journey_ref}: {e}")
+        return None
     except Exception as e:
         logger.error(f"Error getting timetable: {e}")
         return None
 
 
-def find_stop_arrival_time(timetable_data: Dict, stop_name_keyword: str) -> Optional[datetime]:
-    """Find arrival time at a specific stop from timetable data"""
-    rows = timetable_data.get("rows", [])
-    columns = timetable_data.get("columns", [])
-    
-    if not columns:
-        return None
+class ParsedTimetable:
+    """
+    Estimated timetable response indexed by stop, built once per response
+    Arrivals are looked up by stop reference in O(1); name keyword lookups scan
+    the rows once per keyword and are memoized. Instances are immutable apart
+    from that memo, so cached ones are shared safely between threads.
+    """
+    __slots__ = ("stops", "_by_ref", "_by_keyword")
+
+    def __init__(self, timetable_data: Dict):
+        rows = timetable_data.get("rows", [])
+        columns = timetable_data.get("columns", [])
+        events = columns[0].get("events", {}) if columns else {}
+        
+        # (stop name, stop reference, arrival time) in route order
+        self.stops: List[Tuple[str, Optional[str], Optional[datetime]]] = []
+        self._by_ref: Dict[str, datetime] = {}
+        self._by_keyword: Dict[str, Optional[datetime]] = {}
+        for row in rows:
+            event = events.get(str(row.get("rowIndex")))
+            # Prefer realtime, fallback to scheduled
+            time_str = event and (event.get("realTimeOfEvent") or event.get("timeOfEvent"))
+            arrival = parse_datetime(time_str) if time_str else None
+            stop_ref = row.get("stopReference") or row.get("stopRef")
+            self.stops.append((row.get("stopName", ""), stop_ref, arrival))
+            if stop_ref and arrival and stop_ref not in self._by_ref:
+                self._by_ref[stop_ref] = arrival
+
+    def arrival_at(self, stop_ref: Optional[str] = None, keyword: Optional[str] = None) -> Optional[datetime]:
+        """Arrival at a stop, matched by reference when given, else by a stop name keyword"""
+        if stop_ref:
+            arrival = self._by_ref.get(stop_ref)
+            if arrival or not keyword:
+                return arrival
+        
+        keyword = keyword.lower()
+        if keyword not in self._by_keyword:
+            self._by_keyword[keyword] = next(
+                (arrival for name, _, arrival in self.stops if arrival and keyword in name.lower()),
+                None
+            )
+        return self._by_keyword[keyword]
+
+
+def get_estimated_timetable(
+    timetable_id: str,
+    direction: str,
+    origin_stop_ref: str,
+    origin_departure_time: str,
+    origin_departure_realtime: str,
+    data_frame_ref: str,
+    dated_vehicle_journey_ref: str,
+    deadline: Optional[float] = None,
+    priority: int = UPSTREAM_PRIORITY_FIRST_LEG
+) -> Optional[ParsedTimetable]:
+    """Get estimated timetable for a specific journey
+
+    Responses are parsed and cached per vehicle journey, shared by all routes.
+    Concurrent requests for the same journey share one upstream call. Returns
+    None once the time.monotonic() deadline passes.
+    """
+    cache_key = (data_frame_ref, dated_vehicle_journey_ref, origin_stop_ref)
+    cached, _ = TIMETABLE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+    disk_key = "|".join(cache_key)
+    if DISK_CACHE is not None:
+        data, age = DISK_CACHE.get("timetable", disk_key)
+        if data is not None:
+            timetable = ParsedTimetable(data)
+            TIMETABLE_CACHE.set(cache_key, timetable, age=age)
+            return timetable
+    
+    def fetch():
+        data = _fetch_estimated_timetable(
+            timetable_id=timetable_id,
+            direction=direction,
+            origin_stop_ref=origin_stop_ref,
+            origin_departure_time=origin_departure_time,
+            origin_departure_realtime=origin_departure_realtime,
+            data_frame_ref=data_frame_ref,
+            dated_vehicle_journey_ref=dated_vehicle_journey_ref,
+            deadline=deadline,
+            priority=priority
+        )
+        if data is None:
+            return None
+        timetable = ParsedTimetable(data)
+        TIMETABLE_CACHE.set(cache_key, timetable)
+        if DISK_CACHE is not None:
+            DISK_CACHE.set("timetable", disk_key, {"rows": data.get("rows", []), "columns": data.get("columns", [])},
+                           ttl=TIMETABLE_CACHE_TTL)
+        return timetable
+    
+    try:
+        return UPSTREAM_CALLS.do(("timetable",) + cache_key, fetch, timeout=time_left(deadline))
+    except DeadlineExceeded:
+        return None
+
+
+def timetable_cached(departure: Departure, origin_stop_ref: str) -> bool:
+    """Whether the estimated timetable of a departing bus is in the in-memory cache"""
+    if not departure.has_journey_refs:
+        return False
+    cached, _ = TIMETABLE_CACHE.peek((departure.data_frame_ref, departure.dated_vehicle_journey_ref, origin_stop_ref))
+    return cached is not None
+
+
+def find_stop_arrival_time(timetable_data: Dict, stop_name_keyword: str) -> Optional[datetime]:
+    """Find arrival time at a specific stop from raw timetable data"""
+    return ParsedTimetable(timetable_data).arrival_at(keyword=stop_name_keyword)
+
+
+def parse_datetime(dt_str: str) -> datetime:
+    """Parse datetime string from API"""
+    return datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+
+
+# Stop time records of the GTFS store: (stop index, arrival, departure) in seconds after
+# the service day's noon minus 12h, or (stop index, departure, trip index) for boardings
+GTFS_RECORD = struct.Struct("<iii")
+
+
+def _gtfs_seconds(value: str) -> int:
+    """Seconds of a GTFS HH:MM:SS time (hours may exceed 24); -1 if blank"""
+    if not value:
+        return -1
+    hours, minutes, seconds = value.strip().split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class _GtfsBoardings:
+    """Sequence view of the sorted boarding records, for bisection"""
+    __slots__ = ("data", "offset", "count")
+
+    def __init__(self, data, offset: int, count: int):
+        self.data = data
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> Tuple[int, int, int]:
+        return GTFS_RECORD.unpack_from(self.data, self.offset + i * GTFS_RECORD.size)
+
+
+class GtfsStore:
+    """
+    Scheduled stop times of the commute's services, imported from a GTFS static feed
+    Stop times live in a memory-mapped file: trips' stops in route order, then every
+    boarding sorted by (stop, departure). Opening the store only reads its small
+    JSON index, so cold starts stay fast and pages are loaded on first use.
+    """
+
+    def __init__(self, index: Dict, data: mmap.mmap):
+        self.stops: List[Tuple[str, str]] = [tuple(stop) for stop in index["stops"]]  # (stop_id, name)
+        self.routes: List[str] = index["routes"]
+        self.services: List[Dict] = index["services"]
+        self.trips: List[Tuple[int, int, int, int]] = [tuple(trip) for trip in index["trips"]]  # (first record, count, route, service)
+        self.feed_version = index.get("feed_version")
+        self._stop_index = {stop_id: i for i, (stop_id, _) in enumerate(self.stops)}
+        self._data = data
+        self._boardings = _GtfsBoardings(data, index["boardings_offset"], index["boardings"])
+        self.lookups = 0
+        self.matches = 0
+
+    @classmethod
+    def open(cls, store_dir: str) -> Optional["GtfsStore"]:
+        """Open a store built by build_gtfs_store(); None if there is none"""
+        index_path = os.path.join(store_dir, "index.json")
+        if not os.path.exists(index_path):
+            return None
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            with open(os.path.join(store_dir, "stop_times.bin"), "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable GTFS store in {store_dir}: {e}")
+            return None
+        logger.info(f"Opened GTFS store with {len(index['trips'])} trips from {store_dir}")
+        return cls(index, data)
+
+    def runs_on(self, service: int, day: date) -> bool:
+        """Whether a GTFS service runs on a day, after calendar_dates exceptions"""
+        calendar = self.services[service]
+        day_str = day.strftime("%Y%m%d")
+        if day_str in calendar["added"]:
+            return True
+        if day_str in calendar["removed"]:
+            return False
+        return (calendar["start"] <= day_str <= calendar["end"]
+                and calendar["days"][day.weekday()] == "1")
+
+    def _trip_stops(self, trip: int) -> List[Tuple[int, int, int]]:
+        first, count, _, _ = self.trips[trip]
+        return [GTFS_RECORD.unpack_from(self._data, (first + i) * GTFS_RECORD.size) for i in range(count)]
+
+    @staticmethod
+    def _service_day_start(day: date) -> datetime:
+        """
+        The instant GTFS times of a service day count from: noon minus 12 hours
+        That is local midnight except on daylight saving change days. The
+        subtraction is done in UTC, as aware datetimes subtract in wall clock time.
+        """
+        noon = datetime(day.year, day.month, day.day, 12, tzinfo=DUBLIN_TZ)
+        return noon.astimezone(tz.tzutc()) - timedelta(hours=12)
+
+    def scheduled_stops(
+        self,
+        service_number: str,
+        origin_stop_ref: str,
+        scheduled_departure: datetime
+    ) -> Optional[List[Tuple[str, str, datetime]]]:
+        """
+        Scheduled (stop name, stop reference, arrival) of the stops after boarding, in route order
+        The trip is the one of the service leaving origin_stop_ref at the scheduled
+        departure time; None if the feed has no such trip.
+        """
+        self.lookups += 1
+        stop = self._stop_index.get(origin_stop_ref)
+        if stop is None:
+            return None
+        
+        local_day = scheduled_departure.astimezone(DUBLIN_TZ).date()
+        # Trips after midnight belong to the previous service day, with times past 24:00
+        for day in (local_day, local_day - timedelta(days=1)):
+            base = self._service_day_start(day)
+            seconds = int((scheduled_departure - base).total_seconds())
+            i = bisect_left(self._boardings, (stop, seconds - GTFS_MATCH_TOLERANCE, -1))
+            while i < len(self._boardings):
+                board_stop, departure, trip = self._boardings[i]
+                i += 1
+                if board_stop != stop or departure > seconds + GTFS_MATCH_TOLERANCE:
+                    break
+                _, _, route, service = self.trips[trip]
+                if self.routes[route] != service_number or not self.runs_on(service, day):
+                    continue
+                
+                self.matches += 1
+                stops = self._trip_stops(trip)
+                boarded = next(j for j, (s, _, dep) in enumerate(stops) if s == stop and dep == departure)
+                return [
+                    (self.stops[s][1], self.stops[s][0], (base + timedelta(seconds=arr)).astimezone(tz.tzutc()))
+                    for s, arr, _ in stops[boarded + 1:]
+                    if arr >= 0
+                ]
+        return None
+
+    def scheduled_arrival(
+        self,
+        service_number: str,
+        origin_stop_ref: str,
+        scheduled_departure: datetime,
+        stop_ref: Optional[str] = None,
+        keyword: Optional[str] = None
+    ) -> Optional[datetime]:
+        """Scheduled arrival at a stop, matched by reference when given, else by a stop name keyword"""
+        stops = self.scheduled_stops(service_number, origin_stop_ref, scheduled_departure)
+        for name, ref, arrival in stops or []:
+            if (stop_ref and ref == stop_ref) or (not stop_ref and keyword and keyword.lower() in name.lower()):
+                return arrival
+        return None
+
+    def stats(self) -> Dict:
+        return {
+            "feed_version": self.feed_version,
+            "trips": len(self.trips),
+            "lookups": self.lookups,
+            "matches": self.matches
+        }
+
+
+def build_gtfs_store(feed_path: str, store_dir: str, services: List[str]) -> Dict:
+    """
+    Import the trips of the given service numbers from a GTFS static feed zip
+    The feed is streamed row by row and only those trips are kept, so a full
+    Dublin Bus feed imports in bounded memory. Returns the store's index.
+    """
+    services = set(services)
+    with zipfile.ZipFile(feed_path) as feed:
+        names = set(feed.namelist())
+        
+        def rows(name: str):
+            if name not in names:
+                return
+            with feed.open(name) as f:
+                yield from csv.DictReader(io.TextIOWrapper(f, encoding="utf-8-sig"))
+        
+        route_names = {r["route_id"]: r["route_short_name"] for r in rows("routes.txt")
+                       if r["route_short_name"] in services}
+        trip_ids = {}  # trip_id -> (route short name, service_id)
+        for r in rows("trips.txt"):
+            if r["route_id"] in route_names:
+                trip_ids[r["trip_id"]] = (route_names[r["route_id"]], r["service_id"])
+        
+        # Flat (sequence, stop, arrival, departure) ints per kept trip
+        stop_ids: Dict[str, int] = {}
+        stop_times: Dict[str, array] = {}
+        for r in rows("stop_times.txt"):
+            trip_id = r["trip_id"]
+            if trip_id not in trip_ids:
+                continue
+            stop = stop_ids.setdefault(r["stop_id"], len(stop_ids))
+            stop_times.setdefault(trip_id, array("i")).extend((
+                int(r["stop_sequence"]), stop,
+                _gtfs_seconds(r["arrival_time"]), _gtfs_seconds(r["departure_time"])
+            ))
+        
+        stop_names = {r["stop_id"]: r["stop_name"] for r in rows("stops.txt") if r["stop_id"] in stop_ids}
+        service_ids = {service_id for _, service_id in trip_ids.values()}
+        calendars = {}
+        for r in rows("calendar.txt"):
+            if r["service_id"] in service_ids:
+                calendars[r["service_id"]] = {
+                    "days": "".join(r[day] for day in ("monday", "tuesday", "wednesday", "thursday",
+                                                       "friday", "saturday", "sunday")),
+                    "start": r["start_date"], "end": r["end_date"], "added": [], "removed": []
+                }
+        for r in rows("calendar_dates.txt"):
+            if r["service_id"] in service_ids:
+                calendar = calendars.setdefault(r["service_id"], {
+                    "days": "0000000", "start": "", "end": "", "added": [], "removed": []
+                })
+                calendar["added" if r["exception_type"] == "1" else "removed"].append(r["date"])
+        feed_version = next((r.get("feed_version") for r in rows("feed_info.txt")), None)
+    
+    routes = sorted(services)
+    service_list = sorted(calendars)
+    service_index = {service_id: i for i, service_id in enumerate(service_list)}
+    trips = []
+    boardings = []
+    records = bytearray()
+    for trip_id, flat in stop_times.items():
+        route, service_id = trip_ids[trip_id]
+        if service_id not in service_index:
+            continue
+        trip_rows = sorted(zip(flat[0::4], flat[1::4], flat[2::4], flat[3::4]))
+        first = len(records) // GTFS_RECORD.size
+        trip = len(trips)
+        trips.append((first, len(trip_rows), routes.index(route), service_index[service_id]))
+        for _, stop, arrival, departure in trip_rows:
+            records += GTFS_RECORD.pack(stop, arrival, departure)
+        for _, stop, _, departure in trip_rows[:-1]:
+            if departure >= 0:
+                boardings.append((stop, departure, trip))
+    boardings.sort()
+    boardings_offset = len(records)
+    for boarding in boardings:
+        records += GTFS_RECORD.pack(*boarding)
+    
+    index = {
+        "feed_version": feed_version,
+        "stops": [[stop_id, stop_names.get(stop_id, "")] for stop_id in sorted(stop_ids, key=stop_ids.get)],
+        "routes": routes,
+        "services": [calendars[service_id] for service_id in service_list],
+        "trips": trips,
+        "boardings_offset": boardings_offset,
+        "boardings": len(boardings)
+    }
+    os.makedirs(store_dir, exist_ok=True)
+    for name, content, mode in (("stop_times.bin", records, "wb"), ("index.json", json.dumps(index), "w")):
+        tmp_path = os.path.join(store_dir, f"{name}.{os.getpid()}.tmp")
+        with open(tmp_path, mode) as f:
+            f.write(content)
+        os.replace(tmp_path, os.path.join(store_dir, name))
+    return index
+
+
+GTFS_STORE = GtfsStore.open(GTFS_STORE_DIR)
+
+
+@app.cli.command("build-gtfs")
+@click.argument("feed_path")
+@click.option("--store-dir", default=GTFS_STORE_DIR, show_default=True, help="Directory to write the store to")
+def build_gtfs_command(feed_path: str, store_dir: str):
+    """Import the commute's scheduled stop times from a GTFS static feed zip"""
+    index = build_gtfs_store(feed_path, store_dir, GTFS_SERVICES)
+    click.echo(f"Imported {len(index['trips'])} trips of {', '.join(GTFS_SERVICES)} "
+               f"({len(index['stops'])} stops) into {store_dir}")
+
+
+def prefetch_interval(now: datetime) -> Optional[float]:
+    """Seconds between departure board polls at a local time; None while idle overnight"""
+    idle_start, idle_end = PREFETCH_IDLE_HOURS
+    if idle_start <= now.hour < idle_end:
+        return None
+    for peak_start, peak_end in PREFETCH_PEAK_HOURS:
+        if peak_start <= now.hour < peak_end:
+            return PREFETCH_PEAK_INTERVAL
+    return PREFETCH_OFFPEAK_INTERVAL
+
+
+class DeparturePrefetcher:
+    """
+    Background thread keeping the commute stops' departure boards warm in DEPARTURES_CACHE
+    Among gunicorn workers, only the holder of an exclusive lock on the lock file
+    polls upstream; it publishes the boards to a spool file that the other
+    workers load into their own caches.
+    """
+
+    def __init__(self, stops: List[Tuple[str, str]], lock_path: str, spool_path: str):
+        self.stops = stops
+        self.lock_path = lock_path
+        self.spool_path = spool_path
+        self._lock_file = None
+        self._spool_mtime = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.is_leader = False
+        self.interval = None
+        self.polls = 0
+        self.spool_loads = 0
+        self.last_run = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+        logger.info("Started departure prefetcher")
+
+    def _run(self):
+        while True:
+            self.interval = prefetch_interval(datetime.now(DUBLIN_TZ))
+            if self.interval is not None:
+                try:
+                    self._tick()
+                except Exception as e:
+                    logger.error(f"Error prefetching departures: {e}")
+            time.sleep(self.interval or PREFETCH_IDLE_CHECK_INTERVAL)
+
+    def _tick(self):
+        if self._try_lead():
+            self._poll()
+        else:
+            self._load_spool()
+        self.last_run = datetime.utcnow()
+
+    def _try_lead(self) -> bool:
+        """Take (or keep) leadership; the lock is released only when the process exits"""
+        if self.is_leader or fcntl is None:
+            self.is_leader = True
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        logger.info(f"Worker {os.getpid()} is now the departure prefetch leader")
+        return True
+
+    def _poll(self):
+        """Fetch every stop's board into the cache and publish them to the spool file"""
+        boards = {}
+        fetched = _load_departures_batch(self.stops) or {}
+        for stop_id, stop_name in self.stops:
+            departures = fetched.get(stop_id)
+            if departures is None:
+                departures = _load_departures(stop_id, stop_name)
+            if departures is not None:
+                boards[stop_id] = [d.to_api() for d in departures]
+        self.polls += 1
+        
+        if not boards:
+            return
+        spool = {"fetched_at": time.time(), "boards": boards}
+        tmp_path = f"{self.spool_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(spool, f)
+        os.replace(tmp_path, self.spool_path)
+
+    def _load_spool(self):
+        """Load the leader's boards into this worker's cache when the spool file has changed"""
+        try:
+            mtime = os.path.getmtime(self.spool_path)
+        except OSError:
+            return
+        if mtime == self._spool_mtime:
+            return
+        
+        with open(self.spool_path) as f:
+            spool = json.load(f)
+        self._spool_mtime = mtime
+        
+        age = max(time.time() - spool["fetched_at"], 0)
+        if age > DEPARTURES_CACHE_TTL + DEPARTURES_CACHE_STALE_TTL:
+            return
+        for stop_id, departures in spool["boards"].items():
+            DEPARTURES_CACHE.set(stop_id, [Departure.from_api(d) for d in departures], age=age)
+        self.spool_loads += 1
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": PREFETCH_ENABLED,
+            "running": self._thread is not None,
+            "leader": self.is_leader,
+            "interval_seconds": self.interval,
+            "polls": self.polls,
+            "spool_loads": self.spool_loads,
+            "last_run": self.last_run.isoformat() if self.last_run else None
+        }
+
+
+PREFETCHER = DeparturePrefetcher(PREFETCH_STOPS, PREFETCH_LOCK_PATH, PREFETCH_SPOOL_PATH)
+
+
+@app.before_request
+def start_prefetcher():
+    # gunicorn workers start theirs on boot (gunicorn.conf.py); this covers other servers
+    if PREFETCH_ENABLED:
+        PREFETCHER.start()
+
+
+@app.after_request
+def add_budget_header(response):
+    response.headers["X-Upstream-Budget-Remaining"] = str(UPSTREAM_BUDGET.stats()["remaining"])
+    return response
+
+
+def departure_board_signature(stop_ids: List[str]) -> Optional[Tuple]:
+    """
+    Fingerprint of the cached departure boards for some stops
+    Changes whenever a departure is added, dropped, cancelled or gets a new
+    realtime time; None if any board is missing or stale.
+    """
+    signature = []
+    for stop_id in stop_ids:
+        departures, is_fresh = DEPARTURES_CACHE.peek(stop_id)
+        if departures is None or not is_fresh:
+            return None
+        signature.append(tuple(
+            (d.dated_vehicle_journey_ref, d.departure_time, d.cancelled)
+            for d in departures
+        ))
+    return tuple(signature)
+
+
+class RouteTable:
+    """
+    Materialized route set for one direction, ordered by first-leg departure
+    Valid for any horizon up to the one it was computed for, while the departure
+    boards it was built from are unchanged; each read trims it to now + h.
+    Departure and total journey times are kept alongside the routes, so a
+    horizon is a bisected range whose fastest and earliest routes are found
+    without sorting.
+    """
+
+    def __init__(self, routes: List[Dict], first_leg: str, hours: float, board_signature: Tuple):
+        entries = sorted(
+            ((parse_datetime(route[first_leg]["departure_time_iso"]).replace(tzinfo=None),
+              route["total_journey_minutes"], route) for route in routes),
+            key=lambda entry: entry[:2]
+        )
+        self.departures = [departure for departure, _, _ in entries]
+        self.totals = [total for _, total, _ in entries]
+        self.routes = [route for _, _, route in entries]
+        self.hours = hours
+        self.board_signature = board_signature
+        self.computed_at = time.monotonic()
+
+    def age(self) -> float:
+        return time.monotonic() - self.computed_at
+
+    def covers(self, board_signature: Optional[Tuple], hours: float) -> bool:
+        return (
+            board_signature is not None
+            and board_signature == self.board_signature
+            and hours <= self.hours
+            and self.age() <= ROUTE_TABLE_MAX_AGE
+        )
+
+    def bounds(self, now: Optional[datetime], time_limit: datetime) -> Tuple[int, int]:
+        """Index range of the routes whose first leg has not left by now and departs by time_limit"""
+        start = bisect_right(self.departures, now) if now is not None else 0
+        return start, bisect_right(self.departures, time_limit)
+
+    def select(self, now: Optional[datetime], time_limit: datetime, others: int) -> Tuple[Optional[Dict], List[Dict], int]:
+        """
+        (fastest route, next earliest `others` routes, number of routes) of a horizon
+        now=None keeps routes whose first leg may already have left.
+        """
+        start, end = self.bounds(now, time_limit)
+        if start >= end:
+            return None, [], 0
+        # The earlier departure wins a tie
+        fastest = min(range(start, end), key=self.totals.__getitem__)
+        other_routes = [self.routes[i] for i in range(start, min(end, start + others + 1)) if i != fastest]
+        return self.routes[fastest], other_routes[:others], end - start
+
+
+# Latest materialized route table per route name, also served as the last good route set
+ROUTE_TABLES: Dict[str, RouteTable] = {}
+ROUTE_TABLE_STATS = {"reads": 0, "rebuilds": 0, "stale_reads": 0}
+ROUTE_TABLE_STATS_LOCK = threading.Lock()
+
+
+def route_table_counts() -> Dict[str, int]:
+    """Snapshot of the route table counters"""
+    with ROUTE_TABLE_STATS_LOCK:
+        return dict(ROUTE_TABLE_STATS)
+
+
+def count_route_table(stat: str):
+    """Count a route table read, rebuild or stale read under the stats lock"""
+    with ROUTE_TABLE_STATS_LOCK:
+        ROUTE_TABLE_STATS[stat] += 1
+
+
+class RouteError(Exception):
+    """A route request that cannot be answered, with the HTTP status to report"""
+
+    def __init__(self, message: str, status: int, partial: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.partial = partial  # the latency budget ran out, so the answer may differ with more time
+
+
+async def get_departures_async(stop_id: str, stop_name: str, deadline: Optional[float] = None) -> List[Departure]:
+    """Async version of get_departures for the route engine, run on the shared worker pool"""
+    return await UPSTREAM_POOL.run(get_departures, stop_id, stop_name, deadline)
+
+
+async def get_departures_batch_async(
+    stops: List[Tuple[str, str]],
+    deadline: Optional[float] = None
+) -> List[List[Departure]]:
+    """Departures of each stop, batched as in get_departures_batch, falling back to concurrent single-stop calls"""
+    boards = await UPSTREAM_POOL.run(get_departures_batch, stops, deadline)
+    missing = [(stop_id, stop_name) for stop_id, stop_name in stops if stop_id not in boards]
+    fetched = await asyncio.gather(*(
+        get_departures_async(stop_id, stop_name, deadline) for stop_id, stop_name in missing
+    ))
+    boards.update(zip((stop_id for stop_id, _ in missing), fetched))
+    return [boards[stop_id] for stop_id, _ in stops]
+
+
+async def get_estimated_timetable_async(**kwargs) -> Optional[ParsedTimetable]:
+    """Async version of get_estimated_timetable for the route engine, run on the shared worker pool"""
+    return await UPSTREAM_POOL.run(get_estimated_timetable, **kwargs)
+
+
+async def collect_routes(
+    plans: List,
+    min_routes: int,
+    deadline: float,
+    budget_deadline: float
+) -> Tuple[List[Dict], bool]:
+    """
+    Collect route results as each route pipeline completes
+    Once the deadline (a time.monotonic() value) has passed, stops as soon as
+    min_routes routes are complete; at the budget deadline, stops regardless.
+    Pipelines still running are cancelled. Returns (routes, is_partial); routes are
+    partial if any pipeline was dropped or the budget ran out, since lookups
+    skipped at the budget fall back to default durations.
+    """
+    pending = {asyncio.ensure_future(plan) for plan in plans}
+    routes = []
+    
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            budget_remaining = budget_deadline - time.monotonic()
+            if budget_remaining <= 0 or (remaining <= 0 and len(routes) >= min_routes):
+                break
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=min(remaining, budget_remaining) if remaining > 0 else budget_remaining,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                route = task.result()
+                if route:
+                    routes.append(route)
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    if pending:
+        logger.info(f"Deadline passed with {len(routes)} routes complete, dropping {len(pending)} still running")
+    
+    return routes, bool(pending) or time_left(budget_deadline) <= 0
+
+
+@app.route("/")
+def root():
+    return jsonify({
+        "message": "Dublin Bus Route Optimizer API",
+        "endpoints": {
+            **{f"/best-route/{route.path}": route.description for route in ROUTES},
+            "/plan?from=&to=": "Plan the earliest arrival between two stops from cached data",
+            "/stats": "Get cache and upstream call statistics",
+            "/metrics": "Stage latencies, upstream calls, cache and executor metrics in Prometheus format"
+        }
+    })
+
+
+@app.route("/stats")
+def stats():
+    return jsonify({
+        "caches": {
+            "departures": DEPARTURES_CACHE.stats(),
+            "timetables": TIMETABLE_CACHE.stats(),
+            "disk": DISK_CACHE.stats() if DISK_CACHE is not None else None
+        },
+        "upstream": UPSTREAM_CALLS.stats(),
+        "upstream_limit": UPSTREAM_LIMIT.stats(),
+        "upstream_budget": UPSTREAM_BUDGET.stats(),
+        "circuit_breakers": {endpoint: breaker.stats() for endpoint, breaker in UPSTREAM_BREAKERS.items()},
+        "executor": UPSTREAM_POOL.stats(),
+        "prefetch": PREFETCHER.stats(),
+        "route_tables": {
+            **route_table_counts(),
+            "directions": {
+                direction: {"routes": len(table.routes), "age_seconds": round(table.age(), 1)}
+                for direction, table in list(ROUTE_TABLES.items())
+            }
+        },
+        "connections": upstream_connection_stats(),
+        "gtfs": GTFS_STORE.stats() if GTFS_STORE is not None else None,
+        "estimator": SEGMENT_ESTIMATOR.stats()
+    })
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of stage latencies, upstream calls, caches and executors"""
+    caches = {"departures": DEPARTURES_CACHE.stats(), "timetables": TIMETABLE_CACHE.stats()}
+    if DISK_CACHE is not None:
+        caches["disk"] = DISK_CACHE.stats()
+    pools = {"upstream": UPSTREAM_POOL.stats(), "route_refresh": ROUTE_REFRESH_POOL.stats()}
+    limit = UPSTREAM_LIMIT.stats()
+    budget = UPSTREAM_BUDGET.stats()
+    breakers = {endpoint: breaker.stats() for endpoint, breaker in UPSTREAM_BREAKERS.items()}
+    
+    lines = STAGE_SECONDS.render() + UPSTREAM_SECONDS.render() + UPSTREAM_CALLS_TOTAL.render()
+    lines += _metric_lines(
+        "dublin_bus_cache_hits_total", "counter", "Cache lookups answered from the cache",
+        [("", {"cache": name}, cache["hits"]) for name, cache in caches.items()]
+    )
+    lines += _metric_lines(
+        "dublin_bus_cache_misses_total", "counter", "Cache lookups that missed",
+        [("", {"cache": name}, cache["misses"]) for name, cache in caches.items()]
+    )
+    lines += _metric_lines(
+        "dublin_bus_cache_hit_ratio", "gauge", "Share of cache lookups that hit since startup",
+        [("", {"cache": name}, cache["hit_ratio"]) for name, cache in caches.items() if cache["hit_ratio"] is not None]
+    )
+    lines += _metric_lines(
+        "dublin_bus_executor_queue_depth", "gauge", "Tasks waiting for a worker thread",
+        [("", {"pool": name}, pool["queue_depth"]) for name, pool in pools.items()]
+    )
+    lines += _metric_lines(
+        "dublin_bus_executor_active", "gauge", "Worker threads running a task",
+        [("", {"pool": name}, pool["active"]) for name, pool in pools.items()]
+    )
+    lines += _metric_lines(
+        "dublin_bus_upstream_in_flight", "gauge", "Upstream calls in flight and waiting for a slot",
+        [("", {"state": "in_flight"}, limit["in_flight"]), ("", {"state": "waiting"}, limit["waiting"])]
+    )
+    lines += _metric_lines(
+        "dublin_bus_upstream_budget_remaining", "gauge", "Upstream calls left in the per-minute budget",
+        [("", {}, budget["remaining"])]
+    )
+    lines += _metric_lines(
+        "dublin_bus_circuit_open", "gauge", "1 while an endpoint's circuit breaker refuses calls",
+        [("", {"endpoint": endpoint}, int(breaker["state"] == "open")) for endpoint, breaker in breakers.items()]
+    )
+    lines += _metric_lines(
+        "dublin_bus_upstream_timeout_seconds", "gauge", "Current adaptive timeout per endpoint",
+        [("", {"endpoint": endpoint}, breaker["timeout_seconds"]) for endpoint, breaker in breakers.items()]
+    )
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
+class Ride(NamedTuple):
+    """One leg of a planned route: the bus taken and when it reaches the leg's arrival stop"""
+    leg: Leg
+    departure: Departure
+    arrival: Optional[datetime]
+    confidence: Optional[float] = None  # set when the arrival is a learned estimate
+
+    @property
+    def departure_time(self) -> datetime:
+        return self.departure.departure_time
+
+
+class ConnectionBoard:
+    """
+    Connecting departures sorted by departure time
+    Times are parsed once into a compact array of epoch seconds, so finding the
+    next connections after a transfer is a bisection.
+    """
+    __slots__ = ("times", "departures")
+
+    def __init__(self, departures: List[Departure]):
+        timed = sorted(
+            ((d.departure_time.timestamp(), d) for d in departures if d.departure_time),
+            key=lambda entry: entry[0]
+        )
+        self.times = array("d", (t for t, _ in timed))
+        self.departures = [d for _, d in timed]
+
+    def __len__(self) -> int:
+        return len(self.departures)
+
+    def next_after(self, ready_time: datetime, limit: int = 1) -> List[Departure]:
+        """The first `limit` departures leaving at or after ready_time"""
+        i = bisect_left(self.times, ready_time.timestamp())
+        return self.departures[i:i + limit]
+
+
+class SegmentEstimator:
+    """
+    Ride durations learned from past timetable responses
+    Durations are kept per leg segment, service, day type and local hour as an
+    exponentially weighted mean and variance, so estimates follow changing
+    traffic. Confidence grows with the journeys observed, shrinks with their
+    spread and decays while the segment goes unobserved, so confident segments
+    are looked up again from time to time and keep learning.
+    """
+
+    def __init__(self, smoothing: float, min_samples: int, max_spread: float, max_journeys: int, half_life: float):
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.max_spread = max_spread
+        self.max_journeys = max_journeys
+        self.half_life = half_life
+        self._segments: Dict[Tuple, Tuple[int, float, float, float]] = {}  # key -> (count, mean, variance, observed at)
+        self._journeys: "OrderedDict[Tuple, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.observations = 0
+        self.estimates = 0
+
+    @staticmethod
+    def _key(leg: Leg, departure: Departure) -> Tuple:
+        local = departure.departure_time.astimezone(DUBLIN_TZ)
+        day_type = ("weekday", "saturday", "sunday")[max(local.weekday() - 4, 0)]
+        return (leg.origin_stop, leg.arrival_keyword, departure.service_number, day_type, local.hour)
+
+    def observe(self, leg: Leg, departure: Departure, arrival: datetime):
+        """Learn from a journey's arrival; each journey counts once per segment"""
+        duration = (arrival - departure.departure_time).total_seconds() / 60
+        if duration <= 0:
+            return
+        journey = (departure.data_frame_ref, departure.dated_vehicle_journey_ref, leg.origin_stop, leg.arrival_keyword)
+        key = self._key(leg, departure)
+        with self._lock:
+            if journey in self._journeys:
+                return
+            self._journeys[journey] = None
+            if len(self._journeys) > self.max_journeys:
+                self._journeys.popitem(last=False)
+            
+            count, mean, variance, _ = self._segments.get(key, (0, duration, 0.0, 0.0))
+            diff = duration - mean
+            increment = self.smoothing * diff
+            self._segments[key] = (
+                count + 1, mean + increment, (1 - self.smoothing) * (variance + diff * increment), time.monotonic()
+            )
+            self.observations += 1
+
+    def estimate(self, leg: Leg, departure: Departure) -> Optional[Tuple[float, float]]:
+        """(duration in minutes, confidence from 0 to 1) of a leg's ride on a bus; None if never observed"""
+        with self._lock:
+            segment = self._segments.get(self._key(leg, departure))
+        if segment is None:
+            return None
+        count, mean, variance, observed_at = segment
+        confidence = min(1.0, count / self.min_samples) * max(0.0, 1 - variance ** 0.5 / self.max_spread)
+        confidence *= 0.5 ** ((time.monotonic() - observed_at) / self.half_life)
+        return mean, round(confidence, 2)
+
+    def count_use(self):
+        """Count an estimate used as a leg's arrival"""
+        with self._lock:
+            self.estimates += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "segments": len(self._segments),
+                "observations": self.observations,
+                "estimates": self.estimates
+            }
+
+
+SEGMENT_ESTIMATOR = SegmentEstimator(
+    smoothing=ESTIMATOR_SMOOTHING,
+    min_samples=ESTIMATOR_MIN_SAMPLES,
+    max_spread=ESTIMATOR_MAX_SPREAD,
+    max_journeys=ESTIMATOR_MAX_JOURNEYS,
+    half_life=ESTIMATOR_CONFIDENCE_HALF_LIFE
+)
+
+
+class LegLimiter:
+    """
+    Cap on one route computation's concurrent timetable lookups that serves later legs first
+    A bus whose first leg is known goes on to its next leg ahead of the first-leg
+    lookups still queued, so routes that have started finish one by one instead
+    of all waiting for the last first-leg lookup. Waiters of the same leg keep
+    their arrival order.
+    """
+
+    def __init__(self, limit: int):
+        self._free = limit
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # heap of (-leg index, arrival, future)
+        self._arrivals = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, leg_index: int):
+        if self._free > 0 and not self._waiters:
+            self._free -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (-leg_index, next(self._arrivals), waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Cancelled just after being handed the slot: pass it on
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._free += 1
+
+
+async def compute_routes(
+    route_def: RouteDefinition,
+    time_limit: datetime,
+    hours: float,
+    deadline: float,
+    budget_deadline: float
+) -> Tuple[List[Dict], bool]:
+    """
+    Compute every route of a route definition whose first leg departs before time_limit
+    Each first-leg bus flows straight from its timetable lookup into matching and
+    looking up the following legs, so no route waits for the slowest timetable.
+    Past the deadline, the routes completed so far are returned, flagged as
+    partial if any were dropped.
+    """
+    limiter = LegLimiter(UPSTREAM_CONCURRENCY)
+    legs = route_def.legs
+    first_leg = legs[0]
+    
+    # Step 1: Fetch every leg's departure board, in one upstream call when possible
+    with STAGE_SECONDS.time(route=route_def.name, stage="departures"):
+        boards = await get_departures_batch_async(
+            [(STOPS[leg.origin_stop], leg.origin_stop_name) for leg in legs],
+            budget_deadline
+        )
+    assembly_started = time.perf_counter()
+    
+    if not boards[0]:
+        raise RouteError("Unable to fetch departure data", 503)
+    
+    # Filter first-leg services, exclude cancelled, and within the time window
+    first_departures = []
+    for d in boards[0]:
+        if d.service_number not in first_leg.services:
+            continue
+        if d.cancelled:
+            continue
+        
+        if d.departure_time and d.departure_time.replace(tzinfo=None) <= time_limit:
+            first_departures.append(d)
+    
+    if not first_departures:
+        raise RouteError(f"No {first_leg.description} found in next {hours} hour(s)", 404)
+    
+    logger.info(f"Found {len(first_departures)} {first_leg.description} departures in next {hours} hour(s)")
+    
+    # Filter connecting departures of the following legs
+    connecting_boards = []
+    for leg, board in zip(legs[1:], boards[1:]):
+        connecting = ConnectionBoard([d for d in board
+                                      if d.service_number in leg.services
+                                      and not d.cancelled])
+        if not connecting:
+            raise RouteError(f"No {leg.description} found at {leg.departure_stop}", 404)
+        logger.info(f"Found {len(connecting)} {leg.description} departures at {leg.departure_stop}")
+        connecting_boards.append(connecting)
+    
+    route_candidates = []
+    
+    async def fetch_leg_arrival(leg: Leg, departure: Departure) -> Tuple[Optional[datetime], Optional[float]]:
+        """
+        Look up when a leg's bus reaches the leg's arrival stop
+        Returns the arrival and, when it is a learned estimate, its confidence.
+        Confident estimates skip the timetable lookup unless the bus's timetable
+        is already cached; others are only used when the lookup fails.
+        """
+        # Buses without realtime tracking keep to the schedule, which needs no upstream call
+        if GTFS_STORE is not None and not departure.is_realtime:
+            arrival = GTFS_STORE.scheduled_arrival(
+                departure.service_number,
+                STOPS[leg.origin_stop],
+                departure.departure_time,
+                stop_ref=leg.arrival_stop_ref,
+                keyword=leg.arrival_keyword
+            )
+            if arrival:
+                return arrival, None
+        
+        estimate = SEGMENT_ESTIMATOR.estimate(leg, departure)
+        if (estimate and estimate[1] >= ESTIMATOR_MIN_CONFIDENCE
+                and not timetable_cached(departure, STOPS[leg.origin_stop])):
+            SEGMENT_ESTIMATOR.count_use()
+            return departure.departure_time + timedelta(minutes=estimate[0]), estimate[1]
+        
+        priority = UPSTREAM_PRIORITY_FIRST_LEG if leg is first_leg else UPSTREAM_PRIORITY_LATER_LEGS
+        arrival = await lookup_leg_arrival(leg, departure, priority)
+        if arrival:
+            SEGMENT_ESTIMATOR.observe(leg, departure, arrival)
+            return arrival, None
+        if estimate:
+            SEGMENT_ESTIMATOR.count_use()
+            return departure.departure_time + timedelta(minutes=estimate[0]), estimate[1]
+        if not UPSTREAM_BUDGET.available(priority):
+            # Over the call budget: assume the leg's default duration rather than dropping the route
+            return departure.departure_time + timedelta(minutes=leg.default_duration), 0.0
+        return None, None
+    
+    async def lookup_leg_arrival(leg: Leg, departure: Departure, priority: int) -> Optional[datetime]:
+        """Look up a leg's arrival in its bus's estimated timetable"""
+        if not departure.has_journey_refs:
+            return None
+        
+        leg_index = legs.index(leg)
+        stage = f"leg_{leg_index + 1}_timetable"
+        async with limiter.slot(leg_index):
+            with STAGE_SECONDS.time(route=route_def.name, stage=stage):
+                timetable = await get_estimated_timetable_async(
+                    timetable_id=departure.service_id,
+                    direction=leg.direction,
+                    origin_stop_ref=STOPS[leg.origin_stop],
+                    origin_departure_time=departure.scheduled_departure,
+                    origin_departure_realtime=departure.realtime_departure or departure.scheduled_departure,
+                    data_frame_ref=departure.data_frame_ref,
+                    dated_vehicle_journey_ref=departure.dated_vehicle_journey_ref,
+                    deadline=budget_deadline,
+                    priority=priority
+                )
+        
+        if not timetable:
+            return None
+        return timetable.arrival_at(stop_ref=leg.arrival_stop_ref, keyword=leg.arrival_keyword)
+    
+    def final_arrival(rides: List[Ride]) -> datetime:
+        """Arrival at the end of the route, estimated from the default duration if unknown"""
+        last = rides[-1]
+        return last.arrival or last.departure_time + timedelta(minutes=last.leg.default_duration)
+    
+    async def ride_from(
+        i: int,
+        departure: Departure,
+        arrival: Optional[datetime],
+        confidence: Optional[float] = None
+    ) -> Optional[List[Ride]]:
+        """Rides from leg i on the given bus to the end of the route, taking the best connection at each transfer"""
+        ride = Ride(legs[i], departure, arrival, confidence)
+        if i == len(legs) - 1:
+            return [ride]
+        # Intermediate arrivals are needed to plan the next leg; the last leg falls back to a default duration
+        if not arrival:
+            return None
+        ready_time = arrival + timedelta(minutes=route_def.transfers[i].walk_minutes)
+        rest = await best_connection(i + 1, ready_time)
+        return [ride] + rest if rest else None
+    
+    async def best_connection(i: int, ready_time: datetime) -> Optional[List[Ride]]:
+        """
+        Earliest-arriving rides from leg i onwards, among the next few buses after ready_time
+        A later bus can only arrive first if it leaves before the earliest one arrives,
+        so the other candidates are looked up only when they can still win.
+        """
+        leg = legs[i]
+        candidates = connecting_boards[i - 1].next_after(ready_time, TRANSFER_CONNECTIONS)
+        if not candidates:
+            return None
+        
+        best = await ride_from(i, candidates[0], *await fetch_leg_arrival(leg, candidates[0]))
+        cutoff = final_arrival(best) if best else None
+        contenders = [d for d in candidates[1:] if cutoff is None or d.departure_time < cutoff]
+        
+        async def try_departure(departure: Departure) -> Optional[List[Ride]]:
+            return await ride_from(i, departure, *await fetch_leg_arrival(leg, departure))
+        
+        for rides in await asyncio.gather(*(try_departure(d) for d in contenders)):
+            if rides and (best is None or final_arrival(rides) < final_arrival(best)):
+                best = rides
+        return best
+    
+    async def plan_route(first_departure: Departure):
+        """Run every leg for one first-leg bus; each leg's lookup starts as soon as the previous arrival is known"""
+        arrival, confidence = await fetch_leg_arrival(first_leg, first_departure)
+        if arrival or len(legs) == 1:
+            route_candidates.append(first_departure)
+        rides = await ride_from(0, first_departure, arrival, confidence)
+        return render_route(route_def, rides) if rides else None
+    
+    all_routes, is_partial = await collect_routes(
+        [plan_route(departure) for departure in first_departures],
+        min_routes=ROUTE_COLLECTION_MIN_ROUTES,
+        deadline=deadline,
+        budget_deadline=budget_deadline
+    )
+    
+    if is_partial and not all_routes:
+        raise RouteError("Latency budget ran out before any route was complete", 504, partial=True)
+    
+    if not route_candidates:
+        raise RouteError(f"Could not fetch timetables for any {first_leg.description}", 404)
+    
+    logger.info(f"Successfully fetched {len(route_candidates)} {first_leg.description} timetables")
+    
+    if not all_routes:
+        raise RouteError("Could not calculate any routes", 404)
+    
+    # Matching connections and collecting routes, including the time spent waiting on lookups
+    STAGE_SECONDS.observe(time.perf_counter() - assembly_started, route=route_def.name, stage="route_assembly")
+    return all_routes, is_partial
+
+
+def render_route(route_def: RouteDefinition, rides: List[Ride]) -> Dict:
+    """Build the JSON description of one route from its rides"""
+    route = {}
+    wait_minutes = 0
+    last = rides[-1]
+    last_duration = last.leg.default_duration
     
-    events = columns[0].get("events", {})
+    for i, ride in enumerate(rides):
+        is_first = i == 0
+        is_last = ride is last
+        if ride.arrival:
+            duration = (ride.arrival - ride.departure_time).total_seconds() / 60
+        else:
+            duration = ride.leg.default_duration
+        if is_last:
+            last_duration = duration
+        
+        leg_info = {
+            "service": ride.departure.service_number,
+            "departure_time": ride.departure_time.strftime("%H:%M"),
+            "departure_time_iso": ride.departure_time.isoformat(),
+            "is_realtime": ride.departure.is_realtime,
+            "departure_stop": ride.leg.departure_stop,
+            "arrival_stop": ride.leg.arrival_stop,
+            "duration_minutes": round(duration, 1)
+        }
+        if not is_first:
+            leg_info["arrival_time"] = ride.arrival.strftime("%H:%M") if ride.arrival else None
+            leg_info["destination"] = ride.departure.destination
+        if ride.confidence is not None:
+            leg_info["estimated_confidence"] = ride.confidence
+        route[ride.leg.key] = leg_info
+        
+        if is_last:
+            continue
+        
+        transfer = route_def.transfers[i]
+        next_ride = rides[i + 1]
+        walk_arrival = ride.arrival + timedelta(minutes=transfer.walk_minutes)
+        wait_minutes += (next_ride.departure_time - walk_arrival).total_seconds() / 60
+        route[transfer.arrival_key] = {
+            "time": ride.arrival.strftime("%H:%M"),
+            "time_iso": ride.arrival.isoformat()
+        }
+        route[transfer.walk_key] = {
+            "from": ride.leg.arrival_stop,
+            "to": next_ride.leg.departure_stop,
+            "duration_minutes": transfer.walk_minutes
+        }
+        route[transfer.walk_arrival_key] = {
+            "time": walk_arrival.strftime("%H:%M"),
+            "time_iso": walk_arrival.isoformat()
+        }
     
-    # Find the stop by name
-    for row in rows:
-        if stop_name_keyword.lower() in row.get("stopName", "").lower():
-            row_index = str(row.get("rowIndex"))
-            event = events.get(row_index)
-            
-            if event:
-                # Prefer realtime, fallback to scheduled
-                time_str = event.get("realTimeOfEvent") or event.get("timeOfEvent")
-                if time_str:
-                    return datetime.fromisoformat(time_str.replace("Z", "+00:00"))
+    route["wait_minutes"] = round(wait_minutes, 1)
+    route["total_journey_minutes"] = round(
+        (last.departure_time - rides[0].departure_time).total_seconds() / 60 + last_duration, 1
+    )
+    return route
+
+
+def render_route_summary(route_def: RouteDefinition, route: Dict) -> str:
+    """Step-by-step text for one route"""
+    legs = route_def.legs
+    lines = []
+    for i, leg in enumerate(legs):
+        leg_info = route[leg.key]
+        if i == 0:
+            lines.append(f"🚏 {leg_info['departure_time']} - Wait for {leg.service_prefix}{leg_info['service']} at {leg_info['departure_stop']}")
+        else:
+            transfer = route_def.transfers[i - 1]
+            walk = route[transfer.walk_key]
+            walk_arrival = route[transfer.walk_arrival_key]
+            wait_minutes = round(
+                (parse_datetime(leg_info['departure_time_iso']) - parse_datetime(walk_arrival['time_iso'])).total_seconds() / 60, 1
+            )
+            lines.append(f"🚶 Walk {walk['duration_minutes']} min from {walk['from']} to {walk['to']}")
+            lines.append(f"⏰ Arrive at {walk['to']} at {walk_arrival['time']}")
+            lines.append(f"⏱️  Wait {wait_minutes:.0f} min")
+            lines.append(f"🚏 {leg_info['departure_time']} - Take {leg.service_prefix}{leg_info['service']} at {leg_info['departure_stop']}")
+        
+        arrival_info = ""
+        if leg is legs[-1] and leg_info.get('arrival_time'):
+            arrival_info = f" (arrive {leg_info['arrival_time']})"
+        lines.append(f"🚌 Ride {leg_info['duration_minutes']:.0f} min to {leg_info['arrival_stop']}{arrival_info}")
     
-    return None
+    lines.append(f"⏱️  Total: {route['total_journey_minutes']:.0f} min")
+    return "\n".join(lines)
 
 
-def parse_datetime(dt_str: str) -> datetime:
-    """Parse datetime string from API"""
-    return datetime.fromisoformat(dt_str.replace("Z", "+00:00"))
+ROUTE_REFRESH_POOL = WorkerPool(max_workers=ROUTE_REFRESH_WORKERS, thread_name_prefix="route-refresh")
+# In-flight route set computations by (route name, hours, budget_ms)
+ROUTE_REFRESHES: Dict[Tuple, Future] = {}
+ROUTE_REFRESHES_LOCK = threading.Lock()
 
 
-@app.route("/")
-def root():
-    return jsonify({
-        "message": "Dublin Bus Route Optimizer API",
-        "endpoints": {
-            "/best-route/to-home": "Get best route from Booterstown to home",
-            "/best-route/to-date": "Get best route from home to Booterstown"
-        }
-    })
+def _compute_route_table(
+    route_def: RouteDefinition,
+    time_limit: datetime,
+    hours: float,
+    budget_ms: int,
+    requested_at: float
+) -> Tuple[RouteTable, bool]:
+    """Compute a route set as a RouteTable, keeping it as the route's table when complete; returns (table, is_partial)"""
+    # Deadlines count from the request's arrival, not from when a refresh worker became free
+    deadline = requested_at + ROUTE_COLLECTION_DEADLINE
+    budget_deadline = requested_at + budget_ms / 1000
+    all_routes, is_partial = asyncio.run(
+        compute_routes(route_def, time_limit, hours, deadline, budget_deadline)
+    )
+    board_signature = departure_board_signature([STOPS[leg.origin_stop] for leg in route_def.legs])
+    table = RouteTable(all_routes, route_def.legs[0].key, hours, board_signature)
+    if not is_partial and board_signature is not None:
+        ROUTE_TABLES[route_def.name] = table
+        count_route_table("rebuilds")
+    return table, is_partial
 
 
-@app.route("/best-route/to-home")
-def get_best_route_to_home():
-    """
-    Calculate all possible routes from Booterstown to home within specified hours
-    Route: Booterstown (E1/E2) -> Westmoreland St -> walk 6min -> Eden Quay (15) -> Home
+def refresh_route_table(
+    route_def: RouteDefinition,
+    time_limit: datetime,
+    hours: float,
+    budget_ms: int,
+    requested_at: float
+) -> Future:
+    """Compute a route set on the refresh pool, sharing an in-flight computation of the same request"""
+    key = (route_def.name, hours, budget_ms)
+    with ROUTE_REFRESHES_LOCK:
+        future = ROUTE_REFRESHES.get(key)
+        if future is None:
+            future = ROUTE_REFRESH_POOL.submit(
+                _compute_route_table, route_def, time_limit, hours, budget_ms, requested_at
+            )
+            ROUTE_REFRESHES[key] = future
     
-    Query Parameters:
-    - h: Number of hours to look ahead (default: 1, max: 12)
-    """
+    def forget(done: Future):
+        with ROUTE_REFRESHES_LOCK:
+            if ROUTE_REFRESHES.get(key) is done:
+                del ROUTE_REFRESHES[key]
+    
+    future.add_done_callback(forget)
+    return future
+
+
+def best_route_response(route_def: RouteDefinition):
+    """Calculate all possible routes of a route definition and render the JSON response"""
     try:
         start_time = datetime.utcnow()
-        logger.info("Starting route calculation for to-home")
+        requested_at = time.monotonic()
+        logger.info(f"Starting route calculation for {route_def.name}")
         
         # Get hours parameter from URL, default to 1 hour
         hours = request.args.get('h', default=1, type=float)
         # Limit to reasonable range
         hours = max(0.5, min(hours, 12))
+        budget_ms = request.args.get('budget_ms', default=DEFAULT_BUDGET_MS, type=int)
+        budget_ms = max(MIN_BUDGET_MS, min(budget_ms, MAX_BUDGET_MS))
         
         now = datetime.utcnow().replace(tzinfo=None)
         time_limit = now + timedelta(hours=hours)
-        
-        # Step 1: Parallel fetch both departure lists
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_e_buses = executor.submit(get_departures, STOPS["booterstown"], "Booterstown Avenue, Mount Merrion")
-            future_bus_15 = executor.submit(get_departures, STOPS["eden_quay"], "Eden Quay, Dublin")
-            
-            departures = future_e_buses.result()
-            bus_15_departures = future_bus_15.result()
-        
-        if not departures:
-            return jsonify({
-                "success": False,
-                "error": "Unable to fetch departure data"
-            }), 503
-        
-        # Filter for E1 and E2 only, exclude cancelled, and within 2 hours
-        e_buses = []
-        for d in departures:
-            if d.get("serviceNumber") not in ["E1", "E2"]:
-                continue
-            if d.get("cancelled", False):
-                continue
-            
-            dep_time_str = d.get("realTimeDeparture") or d.get("scheduledDeparture")
-            if dep_time_str:
-                dep_time = parse_datetime(dep_time_str).replace(tzinfo=None)
-                if dep_time <= time_limit:
-                    e_buses.append(d)
-        
-        if not e_buses:
-            return jsonify({
-                "success": False,
-                "error": f"No E1/E2 buses found in next {hours} hour(s)"
-            }), 404
-        
-        logger.info(f"Found {len(e_buses)} E1/E2 buses in next {hours} hour(s)")
-        
-        # Filter bus 15 departures
-        bus_15_departures = [d for d in bus_15_departures
-                            if d.get("serviceNumber") == "15"
-                            and not d.get("cancelled", False)]
-        
-        if not bus_15_departures:
-            return jsonify({
-                "success": False,
-                "error": "No 15 buses found at Eden Quay"
-            }), 404
-        
-        logger.info(f"Found {len(bus_15_departures)} bus 15 departures")
-        
-        # Step 2: Parallel fetch all E bus timetables
-        route_candidates = []
-        
-        def fetch_e_bus_timetable(e_bus):
-            """Helper function to fetch E bus timetable"""
-            service_num = e_bus.get("serviceNumber")
-            vehicle = e_bus.get("vehicle", {})
-            
-            if not vehicle.get("dataFrameRef") or not vehicle.get("datedVehicleJourneyRef"):
-                return None
-            
-            departure_time_str = e_bus.get("realTimeDeparture") or e_bus.get("scheduledDeparture")
-            if not departure_time_str:
-                return None
-            
-            departure_time = parse_datetime(departure_time_str)
-            timetable_id = e_bus.get("serviceID")
-            
-            timetable_data = get_estimated_timetable(
-                timetable_id=timetable_id,
-                direction="INBOUND",
-                origin_stop_ref=STOPS["booterstown"],
-                origin_departure_time=e_bus.get("scheduledDeparture"),
-                origin_departure_realtime=e_bus.get("realTimeDeparture") or e_bus.get("scheduledDeparture"),
-                data_frame_ref=vehicle.get("dataFrameRef"),
-                dated_vehicle_journey_ref=vehicle.get("datedVehicleJourneyRef")
-            )
-            
-            if not timetable_data:
-                return None
-            
-            westmoreland_arrival = find_stop_arrival_time(timetable_data, "Westmoreland")
-            if not westmoreland_arrival:
-                return None
-            
-            eden_arrival = westmoreland_arrival + timedelta(minutes=WALK_TIME_WESTMORELAND_TO_EDEN)
-            
-            return {
-                "e_bus": e_bus,
-                "service_num": service_num,
-                "departure_time": departure_time,
-                "westmoreland_arrival": westmoreland_arrival,
-                "eden_arrival": eden_arrival
-            }
-        
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {executor.submit(fetch_e_bus_timetable, e_bus): e_bus for e_bus in e_buses}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    route_candidates.append(result)
-        
-        if not route_candidates:
-            return jsonify({
-                "success": False,
-                "error": "Could not fetch timetables for any E buses"
-            }), 404
-        
-        logger.info(f"Successfully fetched {len(route_candidates)} E bus timetables")
-        
-        # Step 3: Parallel fetch bus 15 timetables for each candidate
-        all_routes = []
-        
-        def fetch_bus_15_timetable(candidate):
-            """Helper function to fetch bus 15 timetable for a route candidate"""
-            e_bus = candidate["e_bus"]
-            service_num = candidate["service_num"]
-            departure_time = candidate["departure_time"]
-            westmoreland_arrival = candidate["westmoreland_arrival"]
-            eden_arrival = candidate["eden_arrival"]
-            
-            # Find next available bus 15
-            next_bus_15 = None
-            for bus_15 in bus_15_departures:
-                if bus_15.get("cancelled", False):
-                    continue
-                    
-                bus_15_time_str = bus_15.get("realTimeDeparture") or bus_15.get("scheduledDeparture")
-                if bus_15_time_str:
-                    bus_15_time = parse_datetime(bus_15_time_str)
-                    if bus_15_time >= eden_arrival:
-                        next_bus_15 = bus_15
-                        break
-            
-            if not next_bus_15:
-                return None
-            
-            bus_15_time_str = next_bus_15.get("realTimeDeparture") or next_bus_15.get("scheduledDeparture")
-            bus_15_time = parse_datetime(bus_15_time_str)
-            
-            # Get bus 15 timetable
-            bus_15_vehicle = next_bus_15.get("vehicle", {})
-            bus_15_duration = 25
-            belmayne_arrival = None
-            
-            if bus_15_vehicle.get("dataFrameRef") and bus_15_vehicle.get("datedVehicleJourneyRef"):
-                bus_15_timetable = get_estimated_timetable(
-                    timetable_id=next_bus_15.get("serviceID"),
-                    direction="INBOUND",
-                    origin_stop_ref=STOPS["eden_quay"],
-                    origin_departure_time=next_bus_15.get("scheduledDeparture"),
-                    origin_departure_realtime=next_bus_15.get("realTimeDeparture") or next_bus_15.get("scheduledDeparture"),
-                    data_frame_ref=bus_15_vehicle.get("dataFrameRef"),
-                    dated_vehicle_journey_ref=bus_15_vehicle.get("datedVehicleJourneyRef")
-                )
-                
-                if bus_15_timetable:
-                    belmayne_arrival = find_stop_arrival_time(bus_15_timetable, "Belmayne")
-                    if belmayne_arrival:
-                        bus_15_duration = (belmayne_arrival - bus_15_time).total_seconds() / 60
-            
-            wait_time = (bus_15_time - eden_arrival).total_seconds() / 60
-            e_bus_duration = (westmoreland_arrival - departure_time).total_seconds() / 60
-            
-            return {
-                "e_bus": {
-                    "service": service_num,
-                    "departure_time": departure_time.strftime("%H:%M"),
-                    "departure_time_iso": departure_time.isoformat(),
-                    "is_realtime": e_bus.get("realTimeDeparture") is not None,
-                    "departure_stop": "Booterstown Avenue",
-                    "arrival_stop": "Westmoreland Street",
-                    "duration_minutes": round(e_bus_duration, 1)
-                },
-                "westmoreland_arrival": {
-                    "time": westmoreland_arrival.strftime("%H:%M"),
-                    "time_iso": westmoreland_arrival.isoformat()
-                },
-                "walk": {
-                    "from": "Westmoreland Street",
-                    "to": "Eden Quay",
-                    "duration_minutes": WALK_TIME_WESTMORELAND_TO_EDEN
-                },
-                "eden_quay_arrival": {
-                    "time": eden_arrival.strftime("%H:%M"),
-                    "time_iso": eden_arrival.isoformat()
-                },
-                "bus_15": {
-                    "service": "15",
-                    "departure_time": bus_15_time.strftime("%H:%M"),
-                    "departure_time_iso": bus_15_time.isoformat(),
-                    "is_realtime": next_bus_15.get("realTimeDeparture") is not None,
-                    "departure_stop": "Eden Quay",
-                    "arrival_stop": "Temple Vw Ave, Belmayne",
-                    "arrival_time": belmayne_arrival.strftime("%H:%M") if belmayne_arrival else None,
-                    "destination": next_bus_15.get("destination"),
-                    "duration_minutes": round(bus_15_duration, 1)
-                },
-                "wait_minutes": round(wait_time, 1),
-                "total_journey_minutes": round((bus_15_time - departure_time).total_seconds() / 60 + bus_15_duration, 1)
-            }
-        
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {executor.submit(fetch_bus_15_timetable, candidate): candidate for candidate in route_candidates}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    all_routes.append(result)
-        
-        if not all_routes:
-            return jsonify({
-                "success": False,
-                "error": "Could not calculate any routes"
-            }), 404
-        
-        # Sort routes by total journey time (fastest first)
-        all_routes.sort(key=lambda x: x['total_journey_minutes'])
-        
-        best_route = all_routes[0]
-        
-        # From remaining routes, select up to 5 with earliest departure times
-        remaining_routes = all_routes[1:]
-        remaining_routes.sort(key=lambda x: x['e_bus']['departure_time_iso'])
-        other_routes = remaining_routes[:5]
+        first_leg = route_def.legs[0]
+        
+        # Serve from the materialized table while the departure boards are unchanged
+        board_stops = [STOPS[leg.origin_stop] for leg in route_def.legs]
+        table = ROUTE_TABLES.get(route_def.name)
+        is_partial = False
+        is_stale = False
+        selection_start = now
+        if table is not None and table.covers(departure_board_signature(board_stops), hours):
+            count_route_table("reads")
+        else:
+            # The last good route set is served if the API is failing or slow; the refresh keeps running
+            last_good = table if (
+                table is not None and table.hours >= hours and table.age() <= route_def.max_staleness
+                and len(range(*table.bounds(now, time_limit)))
+            ) else None
+            refresh = refresh_route_table(route_def, time_limit, hours, budget_ms, requested_at)
+            try:
+                if last_good is not None and any(breaker.is_open() for breaker in UPSTREAM_BREAKERS.values()):
+                    raise CircuitOpen("an upstream circuit breaker is open")
+                grace = None
+                if last_good is not None:
+                    grace = max(0.0, min(STALE_ROUTES_GRACE, requested_at + budget_ms / 1000 - time.monotonic()))
+                table, is_partial = refresh.result(timeout=grace)
+                # Freshly computed routes are all shown, even if their first bus left meanwhile
+                selection_start = None
+            except Exception as e:
+                if last_good is None or (isinstance(e, RouteError) and e.status < 500):
+                    raise
+                if isinstance(e, TimeoutError):
+                    reason = f"still recomputing after {grace:.1f}s"
+                else:
+                    reason = e.message if isinstance(e, RouteError) else str(e)
+                logger.warning(f"Serving {route_def.name} routes from {last_good.age():.0f}s ago: {reason}")
+                table, is_stale = last_good, True
+                count_route_table("stale_reads")
+        
+        # Fastest route, then up to 5 of the others with the earliest departure times
+        rendering_started = time.perf_counter()
+        best_route, other_routes, total_found = table.select(selection_start, time_limit, others=5)
+        if best_route is None:
+            raise RouteError(f"No {first_leg.description} found in next {hours} hour(s)", 404)
         
         elapsed_time = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Found {len(all_routes)} routes in {elapsed_time:.2f}s. Best: {best_route['e_bus']['service']} "
-                   f"at {best_route['e_bus']['departure_time']}")
-        
-        # Create detailed summary for best route
-        e_bus = best_route['e_bus']
-        walk = best_route['walk']
-        bus_15 = best_route['bus_15']
-        
-        arrival_info = f" (arrive {bus_15['arrival_time']})" if bus_15.get('arrival_time') else ""
-        
-        best_route_summary = (
-            f"🚏 {e_bus['departure_time']} - Wait for {e_bus['service']} at {e_bus['departure_stop']}\n"
-            f"🚌 Ride {e_bus['duration_minutes']:.0f} min to {e_bus['arrival_stop']}\n"
-            f"🚶 Walk {walk['duration_minutes']} min from {walk['from']} to {walk['to']}\n"
-            f"⏰ Arrive at {walk['to']} at {best_route['eden_quay_arrival']['time']}\n"
-            f"⏱️  Wait {best_route['wait_minutes']:.0f} min\n"
-            f"🚏 {bus_15['departure_time']} - Take bus {bus_15['service']} at {bus_15['departure_stop']}\n"
-            f"🚌 Ride {bus_15['duration_minutes']:.0f} min to {bus_15['arrival_stop']}{arrival_info}\n"
-            f"⏱️  Total: {best_route['total_journey_minutes']:.0f} min"
-        )
+        logger.info(f"Found {total_found} routes in {elapsed_time:.2f}s. Best: {first_leg.service_prefix}"
+                   f"{best_route[first_leg.key]['service']} at {best_route[first_leg.key]['departure_time']}")
         
         # Create summary for other routes
         other_routes_summary = []
         for route in other_routes:
+            service = route_def.option_service_format.format(
+                **{leg.key: route[leg.key]['service'] for leg in route_def.legs}
+            )
             other_routes_summary.append({
-                "departure_time": route['e_bus']['departure_time'],
-                "service": route['e_bus']['service'],
+                "departure_time": route[first_leg.key]['departure_time'],
+                "service": service,
                 "wait_minutes": route['wait_minutes'],
                 "total_minutes": route['total_journey_minutes'],
-                "summary": f"{route['e_bus']['departure_time']} {route['e_bus']['service']} - Wait {route['wait_minutes']:.0f}min, Total {route['total_journey_minutes']:.0f}min"
+                "summary": f"{route[first_leg.key]['departure_time']} {service} - Wait {route['wait_minutes']:.0f}min, Total {route['total_journey_minutes']:.0f}min"
             })
         
         # Overall summary
-        total_found = len(all_routes)
         displayed_count = len(other_routes) + 1  # +1 for best route
         
         summary = f"📊 Found {total_found} routes in next {hours} hour(s)"
         if total_found > displayed_count:
             summary += f" (showing {displayed_count})"
+        if is_partial:
+            summary += " ⏳ partial: time budget reached"
+        if is_stale:
+            summary += f" ⚠️ live data unavailable, from {table.age():.0f}s ago"
         summary += "\n\n"
         summary += f"⭐ FASTEST ROUTE ({best_route['total_journey_minutes']:.0f} min):\n"
-        summary += best_route_summary
+        summary += render_route_summary(route_def, best_route)
         
         if other_routes_summary:
             summary += f"\n\n📋 Next {len(other_routes_summary)} earliest options:\n"
             for i, other in enumerate(other_routes_summary, 1):
                 summary += f"{i}. {other['summary']}\n"
         
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "route": "to_home",
+            "route": route_def.response_name,
             "total_routes": total_found,
             "displayed_routes": displayed_count,
+            "partial": is_partial,
+            "stale": is_stale,
+            "age_seconds": round(table.age(), 1),
             "best_route": best_route,
             "other_routes": other_routes_summary,
             "summary": summary
         })
+        STAGE_SECONDS.observe(time.perf_counter() - rendering_started, route=route_def.name, stage="rendering")
+        return response
         
+    except RouteError as e:
+        return jsonify({
+            "success": False,
+            "error": e.message,
+            "partial": e.partial
+        }), e.status
     except Exception as e:
         logger.error(f"Error calculating route: {e}", exc_info=True)
         return jsonify({
@@ -473,313 +2795,266 @@ def get_best_route_to_home():
         }), 500
 
 
-@app.route("/best-route/to-date")
-def get_best_route_to_date():
+@app.route("/best-route/<path>")
+def get_best_route(path: str):
     """
-    Calculate all possible routes from home to Booterstown within specified hours
-    Route: Home (15) -> Hawkins St -> walk 5min -> D'Olier Street (E1/E2) -> Booterstown
+    Calculate all possible routes of a configured commute within specified hours
+    See ROUTES for the available paths, e.g. /best-route/to-home
     
     Query Parameters:
     - h: Number of hours to look ahead (default: 1, max: 12)
+    - budget_ms: Latency budget in milliseconds (default: 8000); past it the
+      routes computed so far are returned, marked partial
     """
-    try:
-        start_time = datetime.utcnow()
-        logger.info("Starting route calculation for to-date")
-        
-        # Get hours parameter from URL, default to 1 hour
-        hours = request.args.get('h', default=1, type=float)
-        # Limit to reasonable range
-        hours = max(0.5, min(hours, 12))
-        
-        now = datetime.utcnow().replace(tzinfo=None)
-        time_limit = now + timedelta(hours=hours)
-        
-        # Step 1: Parallel fetch both departure lists
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            future_bus_15 = executor.submit(get_departures, STOPS["temple_view"], "Temple Vw Ave, Clare Hall")
-            future_e_buses = executor.submit(get_departures, STOPS["dolier_street"], "D'Olier Street, Dublin City South")
-            
-            departures = future_bus_15.result()
-            e_bus_departures = future_e_buses.result()
-        
-        if not departures:
-            return jsonify({
-                "success": False,
-                "error": "Unable to fetch departure data"
-            }), 503
-        
-        # Filter for bus 15 only, exclude cancelled, and within 2 hours
-        bus_15_list = []
+    route_def = ROUTES_BY_PATH.get(path)
+    if route_def is None:
+        return jsonify({
+            "success": False,
+            "error": f"Unknown route: {path}"
+        }), 404
+    return best_route_response(route_def)
+
+
+class PlanTrip(NamedTuple):
+    """A bus boarding at a planner stop, and when it reaches the planner stops further along"""
+    departure: Departure
+    board: str  # key into PLAN_STOPS
+    arrivals: List[Tuple[str, datetime]]  # in route order
+    estimated: bool  # arrivals assumed from a leg's default duration, as no timetable was cached
+
+
+class PlanLabel(NamedTuple):
+    """Earliest known arrival at a stop, and the step that reached it"""
+    arrival: datetime
+    step: Optional[Dict]  # None at the origin
+    previous: Optional["PlanLabel"]
+
+
+def plan_stop_matching(stop_name: str) -> Optional[str]:
+    """Key of the planner stop a timetable stop name refers to"""
+    name = stop_name.lower()
+    for key, plan_stop in PLAN_STOPS.items():
+        if any(keyword.lower() in name for keyword in plan_stop.keywords):
+            return key
+    return None
+
+
+def cached_plan_trips() -> Tuple[Dict[str, List[PlanTrip]], List[str]]:
+    """
+    Trips boarding at each planner stop, sorted by departure time, from cached data only
+    Arrivals come from cached estimated timetables, or the GTFS schedule for buses
+    without realtime tracking; other buses are assumed to reach their leg's
+    alighting stop after the leg's default duration. Also
+    returns the stops whose departure boards are not cached.
+    """
+    trips = {}
+    missing = []
+    for key, plan_stop in PLAN_STOPS.items():
+        if plan_stop.stop is None:
+            continue
+        stop_id = STOPS[plan_stop.stop]
+        departures, _ = DEPARTURES_CACHE.peek(stop_id)
+        if departures is None:
+            departures, _ = _restore_departures(stop_id)
+        if departures is None:
+            missing.append(stop_id)
+            continue
+        
+        legs = [leg for route in ROUTES for leg in route.legs if STOPS[leg.origin_stop] == stop_id]
+        board_trips = []
         for d in departures:
-            if d.get("serviceNumber") != "15":
+            if d.cancelled or not d.departure_time:
                 continue
-            if d.get("cancelled", False):
-                continue
-            
-            dep_time_str = d.get("realTimeDeparture") or d.get("scheduledDeparture")
-            if dep_time_str:
-                dep_time = parse_datetime(dep_time_str).replace(tzinfo=None)
-                if dep_time <= time_limit:
-                    bus_15_list.append(d)
-        
-        if not bus_15_list:
-            return jsonify({
-                "success": False,
-                "error": f"No bus 15 found in next {hours} hour(s)"
-            }), 404
-        
-        logger.info(f"Found {len(bus_15_list)} bus 15 departures in next {hours} hour(s)")
-        
-        # Filter E1/E2 departures
-        e_bus_departures = [d for d in e_bus_departures
-                           if d.get("serviceNumber") in ["E1", "E2"]
-                           and not d.get("cancelled", False)]
-        
-        if not e_bus_departures:
-            return jsonify({
-                "success": False,
-                "error": "No E1/E2 buses found at D'Olier Street"
-            }), 404
-        
-        logger.info(f"Found {len(e_bus_departures)} E1/E2 departures")
-        
-        # Step 2: Parallel fetch all bus 15 timetables
-        route_candidates = []
-        
-        def fetch_bus_15_timetable(bus_15):
-            """Helper function to fetch bus 15 timetable"""
-            vehicle = bus_15.get("vehicle", {})
-            
-            if not vehicle.get("dataFrameRef") or not vehicle.get("datedVehicleJourneyRef"):
-                return None
-            
-            departure_time_str = bus_15.get("realTimeDeparture") or bus_15.get("scheduledDeparture")
-            if not departure_time_str:
-                return None
-            
-            departure_time = parse_datetime(departure_time_str)
-            timetable_id = bus_15.get("serviceID")
-            
-            timetable_data = get_estimated_timetable(
-                timetable_id=timetable_id,
-                direction="OUTBOUND",
-                origin_stop_ref=STOPS["temple_view"],
-                origin_departure_time=bus_15.get("scheduledDeparture"),
-                origin_departure_realtime=bus_15.get("realTimeDeparture") or bus_15.get("scheduledDeparture"),
-                data_frame_ref=vehicle.get("dataFrameRef"),
-                dated_vehicle_journey_ref=vehicle.get("datedVehicleJourneyRef")
-            )
-            
-            if not timetable_data:
-                return None
-            
-            hawkins_arrival = find_stop_arrival_time(timetable_data, "Hawkins")
-            if not hawkins_arrival:
-                return None
-            
-            dolier_arrival = hawkins_arrival + timedelta(minutes=WALK_TIME_HAWKINS_TO_DOLIER)
-            
-            return {
-                "bus_15": bus_15,
-                "departure_time": departure_time,
-                "hawkins_arrival": hawkins_arrival,
-                "dolier_arrival": dolier_arrival
-            }
-        
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {executor.submit(fetch_bus_15_timetable, bus_15): bus_15 for bus_15 in bus_15_list}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    route_candidates.append(result)
-        
-        if not route_candidates:
-            return jsonify({
-                "success": False,
-                "error": "Could not fetch timetables for any bus 15"
-            }), 404
-        
-        logger.info(f"Successfully fetched {len(route_candidates)} bus 15 timetables")
-        
-        # Step 3: Parallel fetch E bus timetables for each candidate
-        all_routes = []
-        
-        def fetch_e_bus_timetable(candidate):
-            """Helper function to fetch E bus timetable for a route candidate"""
-            bus_15 = candidate["bus_15"]
-            departure_time = candidate["departure_time"]
-            hawkins_arrival = candidate["hawkins_arrival"]
-            dolier_arrival = candidate["dolier_arrival"]
-            
-            # Find next available E1/E2
-            next_e_bus = None
-            for e_bus in e_bus_departures:
-                if e_bus.get("cancelled", False):
-                    continue
-                    
-                e_bus_time_str = e_bus.get("realTimeDeparture") or e_bus.get("scheduledDeparture")
-                if e_bus_time_str:
-                    e_bus_time = parse_datetime(e_bus_time_str)
-                    if e_bus_time >= dolier_arrival:
-                        next_e_bus = e_bus
-                        break
-            
-            if not next_e_bus:
-                return None
-            
-            e_bus_time_str = next_e_bus.get("realTimeDeparture") or next_e_bus.get("scheduledDeparture")
-            e_bus_time = parse_datetime(e_bus_time_str)
-            service_num = next_e_bus.get("serviceNumber")
-            
-            # Get E bus timetable
-            e_bus_vehicle = next_e_bus.get("vehicle", {})
-            e_bus_duration = 15
-            booterstown_arrival = None
-            
-            if e_bus_vehicle.get("dataFrameRef") and e_bus_vehicle.get("datedVehicleJourneyRef"):
-                e_bus_timetable = get_estimated_timetable(
-                    timetable_id=next_e_bus.get("serviceID"),
-                    direction="OUTBOUND",
-                    origin_stop_ref=STOPS["dolier_street"],
-                    origin_departure_time=next_e_bus.get("scheduledDeparture"),
-                    origin_departure_realtime=next_e_bus.get("realTimeDeparture") or next_e_bus.get("scheduledDeparture"),
-                    data_frame_ref=e_bus_vehicle.get("dataFrameRef"),
-                    dated_vehicle_journey_ref=e_bus_vehicle.get("datedVehicleJourneyRef")
-                )
-                
-                if e_bus_timetable:
-                    booterstown_arrival = find_stop_arrival_time(e_bus_timetable, "Booterstown")
-                    if booterstown_arrival:
-                        e_bus_duration = (booterstown_arrival - e_bus_time).total_seconds() / 60
             
-            wait_time = (e_bus_time - dolier_arrival).total_seconds() / 60
-            bus_15_duration = (hawkins_arrival - departure_time).total_seconds() / 60
+            timetable_stops = None
+            if d.has_journey_refs:
+                timetable, _ = TIMETABLE_CACHE.peek((d.data_frame_ref, d.dated_vehicle_journey_ref, stop_id))
+                timetable_stops = timetable.stops if timetable is not None else None
+            if timetable_stops is None and GTFS_STORE is not None and not d.is_realtime:
+                timetable_stops = GTFS_STORE.scheduled_stops(d.service_number, stop_id, d.departure_time)
+            if timetable_stops is not None:
+                arrivals = []
+                reached = {key}
+                for name, _, arrival in timetable_stops:
+                    stop = plan_stop_matching(name)
+                    if stop and stop not in reached and arrival and arrival > d.departure_time:
+                        reached.add(stop)
+                        arrivals.append((stop, arrival))
+                board_trips.append(PlanTrip(d, key, arrivals, False))
+                continue
             
-            return {
-                "bus_15": {
-                    "service": "15",
-                    "departure_time": departure_time.strftime("%H:%M"),
-                    "departure_time_iso": departure_time.isoformat(),
-                    "is_realtime": bus_15.get("realTimeDeparture") is not None,
-                    "departure_stop": "Temple Vw Ave, Clare Hall",
-                    "arrival_stop": "Hawkins Street",
-                    "duration_minutes": round(bus_15_duration, 1)
-                },
-                "hawkins_arrival": {
-                    "time": hawkins_arrival.strftime("%H:%M"),
-                    "time_iso": hawkins_arrival.isoformat()
-                },
-                "walk": {
-                    "from": "Hawkins Street",
-                    "to": "D'Olier Street",
-                    "duration_minutes": WALK_TIME_HAWKINS_TO_DOLIER
-                },
-                "dolier_arrival": {
-                    "time": dolier_arrival.strftime("%H:%M"),
-                    "time_iso": dolier_arrival.isoformat()
-                },
-                "e_bus": {
-                    "service": service_num,
-                    "departure_time": e_bus_time.strftime("%H:%M"),
-                    "departure_time_iso": e_bus_time.isoformat(),
-                    "is_realtime": next_e_bus.get("realTimeDeparture") is not None,
-                    "departure_stop": "D'Olier Street",
-                    "arrival_stop": "Booterstown Avenue",
-                    "arrival_time": booterstown_arrival.strftime("%H:%M") if booterstown_arrival else None,
-                    "destination": next_e_bus.get("destination"),
-                    "duration_minutes": round(e_bus_duration, 1)
-                },
-                "wait_minutes": round(wait_time, 1),
-                "total_journey_minutes": round((e_bus_time - departure_time).total_seconds() / 60 + e_bus_duration, 1)
-            }
-        
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            futures = {executor.submit(fetch_e_bus_timetable, candidate): candidate for candidate in route_candidates}
-            for future in as_completed(futures):
-                result = future.result()
-                if result:
-                    all_routes.append(result)
-        
-        if not all_routes:
+            leg = next((leg for leg in legs if d.service_number in leg.services), None)
+            stop = leg and plan_stop_matching(leg.arrival_stop)
+            if stop:
+                arrival = d.departure_time + timedelta(minutes=leg.default_duration)
+                board_trips.append(PlanTrip(d, key, [(stop, arrival)], True))
+        
+        board_trips.sort(key=lambda trip: trip.departure.departure_time)
+        trips[key] = board_trips
+    return trips, missing
+
+
+def plan_journey(
+    origin: str,
+    destination: str,
+    now: datetime,
+    max_transfers: int,
+    trips: Dict[str, List[PlanTrip]]
+) -> Optional[PlanLabel]:
+    """
+    Earliest arrival at destination leaving origin at now, with at most max_transfers transfers
+    Round-based (RAPTOR): round k finds every stop reachable with k rides by
+    boarding, at the stops improved in the previous round, any trip leaving after
+    the arrival there, then follows the walks from the stops it improved.
+    """
+    walks = {}
+    for a, b, minutes in PLAN_WALKS:
+        walks.setdefault(a, []).append((b, minutes))
+        walks.setdefault(b, []).append((a, minutes))
+    times = {
+        stop: array("d", (trip.departure.departure_time.timestamp() for trip in board_trips))
+        for stop, board_trips in trips.items()
+    }
+    
+    best: Dict[str, PlanLabel] = {origin: PlanLabel(now, None, None)}
+    
+    def improves(stop: str, arrival: datetime) -> bool:
+        current = best.get(stop)
+        target = best.get(destination)
+        return (current is None or arrival < current.arrival) and (target is None or arrival < target.arrival)
+    
+    def walk_from(stops) -> set:
+        walked = set()
+        for stop in stops:
+            label = best[stop]
+            for to, minutes in walks.get(stop, []):
+                arrival = label.arrival + timedelta(minutes=minutes)
+                if improves(to, arrival):
+                    best[to] = PlanLabel(arrival, {
+                        "type": "walk",
+                        "from": PLAN_STOPS[stop].name,
+                        "to": PLAN_STOPS[to].name,
+                        "duration_minutes": minutes,
+                        "arrival_time": arrival.strftime("%H:%M"),
+                        "arrival_time_iso": arrival.isoformat()
+                    }, label)
+                    walked.add(to)
+        return walked
+    
+    marked = {origin} | walk_from([origin])
+    for _ in range(max_transfers + 1):
+        improved: Dict[str, PlanLabel] = {}
+        for stop in marked:
+            label = best[stop]
+            board_trips = trips.get(stop, [])
+            for trip in board_trips[bisect_left(times.get(stop, []), label.arrival.timestamp()):]:
+                for to, arrival in trip.arrivals:
+                    if not improves(to, arrival) or (to in improved and arrival >= improved[to].arrival):
+                        continue
+                    improved[to] = PlanLabel(arrival, {
+                        "type": "ride",
+                        "service": trip.departure.service_number,
+                        "from": PLAN_STOPS[trip.board].name,
+                        "to": PLAN_STOPS[to].name,
+                        "departure_time": trip.departure.departure_time.strftime("%H:%M"),
+                        "departure_time_iso": trip.departure.departure_time.isoformat(),
+                        "arrival_time": arrival.strftime("%H:%M"),
+                        "arrival_time_iso": arrival.isoformat(),
+                        "duration_minutes": round((arrival - trip.departure.departure_time).total_seconds() / 60, 1),
+                        "is_realtime": trip.departure.is_realtime,
+                        "estimated": trip.estimated
+                    }, label)
+        
+        best.update(improved)
+        marked = set(improved) | walk_from(improved)
+        if not marked:
+            break
+    
+    return best.get(destination)
+
+
+@app.route("/plan")
+def plan():
+    """
+    Plan the earliest arrival between two stops, from cached departures and timetables only
+    No upstream calls are made while answering; departure boards missing from the
+    cache are refreshed in the background for later queries.
+    
+    Query Parameters:
+    - from, to: keys of PLAN_STOPS, e.g. booterstown, eden_quay, temple_view
+    - max_transfers: Maximum number of transfers (default: 2, max: 4)
+    """
+    origin = request.args.get("from", "")
+    destination = request.args.get("to", "")
+    origin = PLAN_STOP_ALIASES.get(origin, origin)
+    destination = PLAN_STOP_ALIASES.get(destination, destination)
+    for stop in (origin, destination):
+        if stop not in PLAN_STOPS:
             return jsonify({
                 "success": False,
-                "error": "Could not calculate any routes"
-            }), 404
-        
-        # Sort routes by total journey time (fastest first)
-        all_routes.sort(key=lambda x: x['total_journey_minutes'])
-        
-        best_route = all_routes[0]
-        
-        # From remaining routes, select up to 5 with earliest departure times
-        remaining_routes = all_routes[1:]
-        remaining_routes.sort(key=lambda x: x['bus_15']['departure_time_iso'])
-        other_routes = remaining_routes[:5]
-        
-        elapsed_time = (datetime.utcnow() - start_time).total_seconds()
-        logger.info(f"Found {len(all_routes)} routes in {elapsed_time:.2f}s. Best: bus 15 at {best_route['bus_15']['departure_time']}")
-        
-        # Create detailed summary for best route
-        bus_15 = best_route['bus_15']
-        walk = best_route['walk']
-        e_bus = best_route['e_bus']
-        
-        arrival_info = f" (arrive {e_bus['arrival_time']})" if e_bus.get('arrival_time') else ""
-        
-        best_route_summary = (
-            f"🚏 {bus_15['departure_time']} - Wait for bus {bus_15['service']} at {bus_15['departure_stop']}\n"
-            f"🚌 Ride {bus_15['duration_minutes']:.0f} min to {bus_15['arrival_stop']}\n"
-            f"🚶 Walk {walk['duration_minutes']} min from {walk['from']} to {walk['to']}\n"
-            f"⏰ Arrive at {walk['to']} at {best_route['dolier_arrival']['time']}\n"
-            f"⏱️  Wait {best_route['wait_minutes']:.0f} min\n"
-            f"🚏 {e_bus['departure_time']} - Take {e_bus['service']} at {e_bus['departure_stop']}\n"
-            f"🚌 Ride {e_bus['duration_minutes']:.0f} min to {e_bus['arrival_stop']}{arrival_info}\n"
-            f"⏱️  Total: {best_route['total_journey_minutes']:.0f} min"
-        )
-        
-        # Create summary for other routes
-        other_routes_summary = []
-        for route in other_routes:
-            other_routes_summary.append({
-                "departure_time": route['bus_15']['departure_time'],
-                "service": f"15→{route['e_bus']['service']}",
-                "wait_minutes": route['wait_minutes'],
-                "total_minutes": route['total_journey_minutes'],
-                "summary": f"{route['bus_15']['departure_time']} 15→{route['e_bus']['service']} - Wait {route['wait_minutes']:.0f}min, Total {route['total_journey_minutes']:.0f}min"
-            })
-        
-        # Overall summary
-        total_found = len(all_routes)
-        displayed_count = len(other_routes) + 1  # +1 for best route
-        
-        summary = f"📊 Found {total_found} routes in next {hours} hour(s)"
-        if total_found > displayed_count:
-            summary += f" (showing {displayed_count})"
-        summary += "\n\n"
-        summary += f"⭐ FASTEST ROUTE ({best_route['total_journey_minutes']:.0f} min):\n"
-        summary += best_route_summary
-        
-        if other_routes_summary:
-            summary += f"\n\n📋 Next {len(other_routes_summary)} earliest options:\n"
-            for i, other in enumerate(other_routes_summary, 1):
-                summary += f"{i}. {other['summary']}\n"
-        
+                "error": f"Unknown stop: {stop or '(missing)'}",
+                "stops": {key: plan_stop.name for key, plan_stop in PLAN_STOPS.items()}
+            }), 400
+    if origin == destination:
         return jsonify({
-            "success": True,
-            "route": "to_work",
-            "total_routes": total_found,
-            "displayed_routes": displayed_count,
-            "best_route": best_route,
-            "other_routes": other_routes_summary,
-            "summary": summary
-        })
-        
-    except Exception as e:
-        logger.error(f"Error calculating route: {e}", exc_info=True)
+            "success": False,
+            "error": "from and to must be different stops"
+        }), 400
+    max_transfers = request.args.get("max_transfers", default=PLAN_DEFAULT_MAX_TRANSFERS, type=int)
+    max_transfers = max(0, min(max_transfers, PLAN_MAX_TRANSFERS))
+    
+    start_time = time.perf_counter()
+    trips, missing = cached_plan_trips()
+    stop_names = dict(PREFETCH_STOPS)
+    for stop_id in missing:
+        if DEPARTURES_CACHE.begin_refresh(stop_id):
+            UPSTREAM_POOL.submit(_refresh_departures, stop_id, stop_names[stop_id])
+    
+    now = datetime.now(tz.tzutc())
+    label = plan_journey(origin, destination, now, max_transfers, trips)
+    elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+    
+    if label is None:
         return jsonify({
             "success": False,
-            "error": f"Internal server error: {str(e)}"
-        }), 500
+            "error": f"No journey found from {PLAN_STOPS[origin].name} to {PLAN_STOPS[destination].name} "
+                     f"with at most {max_transfers} transfer(s) in the cached data",
+            "missing_boards": len(missing)
+        }), 503 if missing else 404
+    
+    steps = []
+    while label.step is not None:
+        steps.append(label.step)
+        label = label.previous
+    steps.reverse()
+    
+    rides = [step for step in steps if step["type"] == "ride"]
+    arrival = parse_datetime(steps[-1]["arrival_time_iso"])
+    first_departure = parse_datetime(rides[0]["departure_time_iso"]) if rides else now
+    lines = []
+    for step in steps:
+        if step["type"] == "walk":
+            lines.append(f"🚶 Walk {step['duration_minutes']} min from {step['from']} to {step['to']}")
+        else:
+            lines.append(f"🚏 {step['departure_time']} - Take {step['service']} at {step['from']}")
+            estimated = " (estimated)" if step["estimated"] else ""
+            lines.append(f"🚌 Ride {step['duration_minutes']:.0f} min to {step['to']}{estimated}")
+    lines.append(f"🏁 Arrive at {PLAN_STOPS[destination].name} at {arrival.strftime('%H:%M')}")
+    
+    return jsonify({
+        "success": True,
+        "from": PLAN_STOPS[origin].name,
+        "to": PLAN_STOPS[destination].name,
+        "max_transfers": max_transfers,
+        "transfers": max(len(rides) - 1, 0),
+        "arrival_time": arrival.strftime("%H:%M"),
+        "arrival_time_iso": arrival.isoformat(),
+        "total_journey_minutes": round((arrival - first_departure).total_seconds() / 60, 1),
+        "steps": steps,
+        "trips_considered": sum(len(board_trips) for board_trips in trips.values()),
+        "planning_ms": elapsed_ms,
+        "summary": "\n".join(lines)
+    })
 
 
 # Vercel serverless function handler
@@ -787,4 +3062,10 @@ def handler(request):
     with app.request_context(request.environ):
         return app.full_dispatch_request()
 
+
+if __name__ == "__main__":
+    if PREFETCH_ENABLED:
+        PREFETCHER.start()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "8000")))
+
 # Made with Bob
@@ -0,0 +1,8 @@
+# Loaded by gunicorn from the working directory (see Procfile)
+
+
+def post_worker_init(worker):
+    """Start each worker's departure prefetcher as soon as it boots, not on its first request"""
+    from app import PREFETCH_ENABLED, PREFETCHER
+    if PREFETCH_ENABLED:
+        PREFETCHER.start()